@@ -4,10 +4,14 @@ from PIL import Image
 from st_social_media_links import SocialMediaIcons
 
 import auth_functions
+import firebase_utils as fb_utils
 import utils
 
 st.set_page_config(page_title="Home", page_icon="🏠", layout="centered")
 
+# Connect to Firestore in the background while the user logs in
+fb_utils.warm_up_firestore()
+
 st.image("assets/consistify-logo-full.png", width=300)
 
 def home_page():
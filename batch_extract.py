@@ -0,0 +1,262 @@
+"""Extract habit data from many template photos in parallel.
+
+Walks the given files, directories and glob patterns, fans the images out over a process
+pool and streams one result per image as NDJSON (default) or CSV. Images are read inside
+the worker processes and at most ``2 x workers`` images are in flight at any time, so memory
+stays bounded no matter how many files there are. Results are written in input order.
+
+Images that were processed before with the same year and threshold are served from the
+on-disk result cache (see result_cache) without decoding them.
+
+Usage:
+    python batch_extract.py assets --year 2024
+    python batch_extract.py "archive/**/*.jpeg" --year 2023 --workers 8 --format csv -o results.csv
+
+"""
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from dataclasses import asdict
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import cv2
+
+import image_ingest
+import omr_engine
+import profiling
+import result_cache
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+STAGES = ("decode", "detect", "warp", "measure", "threshold")
+CSV_FIELDS = ["file", "month", "month_name", "binary_array", "cached", "error"] + [f"{stage}_s" for stage in STAGES]
+# Working resolutions of the coarse rectangle search verified to reproduce benchmarks/ground_truth.json
+# exactly (python -m benchmarks.pipeline --detect-max-side N). Other sizes are accepted, check them first.
+VERIFIED_DETECT_MAX_SIDES = (600, 800, 1000, 1200, 1600)
+
+# Result cache of the current process, set up by _init_worker
+_cache: result_cache.ResultCache | None = None
+
+
+def positive_int(value: str) -> int:
+    """argparse type for sizes and counts that must be at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"expected a positive integer, got {value}")
+    return number
+
+
+def iter_image_paths(inputs: Iterable[str], recursive: bool = False) -> Iterator[str]:
+    """Yield the image files named by the inputs (files, directories or glob patterns), lazily."""
+    for item in inputs:
+        if os.path.isdir(item):
+            if recursive:
+                for root, dirs, files in os.walk(item):
+                    dirs.sort()
+                    for name in sorted(files):
+                        if name.lower().endswith(IMAGE_EXTENSIONS):
+                            yield os.path.join(root, name)
+            else:
+                for name in sorted(os.listdir(item)):
+                    path = os.path.join(item, name)
+                    if name.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(path):
+                        yield path
+        elif glob.has_magic(item):
+            for path in sorted(glob.iglob(item, recursive=True)):
+                if path.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(path):
+                    yield path
+        else:
+            yield item
+
+
+def _init_worker(profile: bool = False, cache_path: str | None = None) -> None:
+    global _cache
+    # Parallelism comes from the process pool, keep OpenCV from oversubscribing the cores
+    cv2.setNumThreads(1)
+    if profile:
+        profiling.log_to_stderr()
+    _cache = result_cache.ResultCache(cache_path) if cache_path is not None else None
+
+
+def process_file(path: str,
+                 year: int,
+                 percentage_threshold: int,
+                 detection_max_side: int | None = None,
+                 profile: bool = False) -> dict:
+    """Run the extraction engine on one image file and return a JSON-serialisable record.
+
+    Errors of this image (reading, decoding, OpenCV, template detection or the result cache) are
+    recorded in ``record["error"]`` instead of raised, so one bad file cannot stop a batch.
+
+    """
+    record = {"file": path}
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        image_digest = hashlib.sha256(data).hexdigest()
+        variant = result_cache.variant(image_ingest.decode_reduction(data, pixel_budget=None), detection_max_side)
+
+        result = None
+        if _cache is not None:
+            result = _cache.get(image_digest, year, percentage_threshold, variant, with_overlay=False)
+        record["cached"] = result is not None
+
+        if result is None:
+            with profiling.StageProfiler(profile) as profiler:
+                img = image_ingest.decode_image(data, pixel_budget=None).image
+                profiler.lap("decode", img.shape)
+
+                measurement = omr_engine.measure_template(img, detection_max_side, profiler=profiler)
+                result = omr_engine.extract_from_measurement(img, measurement, year, percentage_threshold,
+                                                             extract_only=True, profiler=profiler)
+            if _cache is not None:
+                _cache.put(image_digest, year, percentage_threshold, result, variant)
+    except (OSError, ValueError, cv2.error, sqlite3.Error, omr_engine.TemplateDetectionError) as e:
+        # Unreadable, undecodable or undetectable images and cache failures only fail their own record
+        record["error"] = str(e)
+        return record
+
+    record.update({
+        "month": result.month,
+        "month_name": result.month_name,
+        "binary_array": result.binary_array.tolist(),
+        "timings": result.timings,
+    })
+    if profile:
+        record["profile"] = {stage: asdict(stats) for stage, stats in result.profile.items()}
+    return record
+
+
+def run_batch(paths: Iterable[str],
+              year: int,
+              percentage_threshold: int = 50,
+              workers: int | None = None,
+              detection_max_side: int | None = None,
+              profile: bool = False,
+              cache_path: str | None = None) -> Iterator[dict]:
+    """Process the images with a pool of worker processes and yield their records in input order.
+
+    Args:
+        paths (Iterable[str]): Image file paths, consumed lazily.
+        year (int): The year of the templates being processed.
+        percentage_threshold (int, optional): Threshold for checkbox detection. Defaults to 50.
+        workers (int | None, optional): Number of worker processes. Defaults to the CPU count,
+        1 runs everything in the current process.
+        detection_max_side (int | None, optional): Working resolution for the rectangle
+        search (see omr_engine.find_template_rectangles). Defaults to full resolution.
+        profile (bool, optional): Add the CPU time, peak allocation and image dimensions of
+        every stage to the records and log them. Defaults to False.
+        cache_path (str | None, optional): Result cache database to check before and fill
+        after processing each image. Defaults to None (no cache).
+
+    Yields:
+        dict: One record per image (see process_file).
+
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        _init_worker(profile, cache_path)
+        for path in paths:
+            yield process_file(path, year, percentage_threshold, detection_max_side, profile)
+        return
+
+    max_in_flight = 2 * workers
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(profile, cache_path)) as executor:
+        pending: deque[Future] = deque()
+        for path in paths:
+            pending.append(executor.submit(process_file, path, year, percentage_threshold, detection_max_side,
+                                           profile))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def write_ndjson(records: Iterable[dict], out) -> int:
+    count = 0
+    for record in records:
+        out.write(json.dumps(record) + "\n")
+        out.flush()
+        count += 1
+    return count
+
+
+def write_csv(records: Iterable[dict], out) -> int:
+    writer = csv.DictWriter(out, fieldnames=CSV_FIELDS)
+    writer.writeheader()
+    count = 0
+    for record in records:
+        row = {
+            "file": record["file"],
+            "month": record.get("month", ""),
+            "month_name": record.get("month_name", ""),
+            "binary_array": json.dumps(record["binary_array"]) if "binary_array" in record else "",
+            "cached": record.get("cached", ""),
+            "error": record.get("error", ""),
+        }
+        timings = record.get("timings", {})
+        for stage in STAGES:
+            row[f"{stage}_s"] = f"{timings[stage]:.6f}" if stage in timings else ""
+        writer.writerow(row)
+        out.flush()
+        count += 1
+    return count
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Extract habit data from template photos in parallel.")
+    parser.add_argument("inputs", nargs="+", help="Image files, directories or glob patterns.")
+    parser.add_argument("--year", type=int, required=True, help="The year of the templates.")
+    parser.add_argument("--threshold", type=int, default=50,
+                        help="Percentage threshold for checkbox detection (default: 50).")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="Number of worker processes (default: number of CPUs).")
+    parser.add_argument("--format", choices=("ndjson", "csv"), default="ndjson", help="Output format.")
+    parser.add_argument("-o", "--output", default="-", help="Output file (default: stdout).")
+    parser.add_argument("--detect-max-side", type=positive_int, default=None,
+                        help="Search the template rectangles on a copy downscaled to this longest side "
+                             "first, falling back to full resolution if needed. Verified to match the "
+                             f"ground truth: {', '.join(map(str, VERIFIED_DETECT_MAX_SIDES))}.")
+    parser.add_argument("--profile", action="store_true",
+                        help="Record CPU time, peak memory and image size per stage (NDJSON) and log them to stderr.")
+    parser.add_argument("--cache", default=None,
+                        help="Result cache database (default: CONSISTIFY_CACHE_PATH or ~/.cache/consistify/results.sqlite).")
+    parser.add_argument("--no-cache", action="store_true", help="Process every image, ignoring the result cache.")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Walk directories recursively.")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+
+    paths = iter_image_paths(args.inputs, args.recursive)
+    cache_path = None
+    if not args.no_cache:
+        # Create the database once in the parent, the workers only open it
+        cache_path = result_cache.ResultCache(args.cache).path
+    records = run_batch(paths, args.year, args.threshold, args.workers, args.detect_max_side, args.profile,
+                        cache_path)
+    writer = write_csv if args.format == "csv" else write_ndjson
+
+    start = time.perf_counter()
+    if args.output == "-":
+        count = writer(records, sys.stdout)
+    else:
+        with open(args.output, "w", newline="") as out:
+            count = writer(records, out)
+    elapsed = time.perf_counter() - start
+
+    print(f"Processed {count} images in {elapsed:.2f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,47 @@
+"""Compare the full extraction pipeline with the data-only (extract_only) fast path.
+
+Run from the repository root:
+    python -m benchmarks.extract_only
+    python -m benchmarks.extract_only --repeat 10 assets/test_img3.jpeg
+
+"""
+import argparse
+import statistics
+import time
+
+import omr_engine
+
+DEFAULT_IMAGES = ["assets/example.png"] + [f"assets/test_img{suffix}.jpeg" for suffix in ("", 2, 3, 4, 5, 6, 7)]
+
+
+def time_extraction(img, year: int, repeat: int, extract_only: bool) -> list[float]:
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        omr_engine.extract_habit_data(img, year, extract_only=extract_only)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("images", nargs="*", default=DEFAULT_IMAGES)
+    parser.add_argument("--year", type=int, default=2024)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'image':<28}{'full (ms)':>12}{'extract_only (ms)':>20}{'saved':>10}")
+    totals = [0.0, 0.0]
+    for path in args.images:
+        img = omr_engine.read_image(path)
+        omr_engine.extract_habit_data(img, args.year)  # warm-up
+        full = statistics.median(time_extraction(img, args.year, args.repeat, extract_only=False))
+        fast = statistics.median(time_extraction(img, args.year, args.repeat, extract_only=True))
+        totals[0] += full
+        totals[1] += fast
+        print(f"{path:<28}{full * 1000:>12.1f}{fast * 1000:>20.1f}{1 - fast / full:>10.0%}")
+    print(f"{'total':<28}{totals[0] * 1000:>12.1f}{totals[1] * 1000:>20.1f}{1 - totals[1] / totals[0]:>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
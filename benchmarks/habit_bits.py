@@ -0,0 +1,131 @@
+"""Benchmark the bitmask analytics of habit_bits against the day-array functions they replace.
+
+Random habit histories are generated as packed masks (users x habits x months). The bit
+operations run on all of them at once, the reference functions run per user on a subset
+(--reference-users) and are extrapolated to the full population. Before timing, the results
+of both are checked to be identical on the subset:
+
+- days performed:  habit_bits.popcount         vs utils.count_total_days (per month)
+- month streak:    habit_bits.longest_run      vs utils.get_longest_streak (per month)
+- monthly totals:  habit_bits.popcount         vs habit_aggregates.monthly_totals (Yearly Insights)
+- lifetime streak: habit_bits.longest_streak   vs utils.streak_stats over the whole history
+                   (also per habit, on 1-D masks)
+
+Run from the repository root:
+    python -m benchmarks.habit_bits
+    python -m benchmarks.habit_bits --users 1000 --years 3
+
+"""
+import argparse
+import calendar
+import time
+
+import numpy as np
+
+import habit_aggregates
+import habit_bits
+import habit_cube
+import utils
+
+
+def random_masks(rng: np.random.Generator, shape: tuple[int, ...], num_days: np.ndarray) -> np.ndarray:
+    """Masks with about 75% of the days performed (the OR of two uniform words)."""
+    words = rng.integers(0, 2**32, size=(2, *shape), dtype=np.uint32)
+    return (words[0] | words[1]) & habit_bits.full_mask(num_days)
+
+
+def user_document(masks: np.ndarray, first_year: int, num_days: np.ndarray) -> dict:
+    """The stored document ({year: {month: {habit: [0/1 per day]}}}) of one user's (habits x months) masks."""
+    document = {}
+    for month_index in range(masks.shape[1]):
+        year, month = first_year + month_index // 12, month_index % 12 + 1
+        document.setdefault(str(year), {})[calendar.month_name[month]] = {
+            f"Habit {habit + 1}": habit_bits.unpack(masks[habit, month_index], num_days[month_index]).tolist()
+            for habit in range(masks.shape[0])
+        }
+    return document
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def reference(masks: np.ndarray, first_year: int, num_days: np.ndarray) -> tuple[dict, dict]:
+    """Compute the statistics of one user (habits x months) with the day-array functions.
+
+    The conversion of the masks into day arrays, aggregates and a HabitCube is not timed.
+
+    """
+    days = [habit_bits.unpack(masks[:, month], num_days[month]).T for month in range(masks.shape[1])]
+    document = user_document(masks, first_year, num_days)
+    cube = habit_cube.build_cube(document)
+    aggregates = {year: habit_aggregates.build_year_aggregates(year_data) for year, year_data in document.items()}
+
+    def monthly_totals():
+        return np.array([np.concatenate([habit_aggregates.monthly_totals(aggregates[year], habit) for year in aggregates])
+                         for habit in cube.habits])
+
+    results, timings = {}, {}
+    results["days performed"], timings["days performed"] = timed(
+        lambda: np.stack([utils.count_total_days(month_days) for month_days in days], axis=-1))
+    results["month streak"], timings["month streak"] = timed(
+        lambda: np.stack([utils.get_longest_streak(month_days) for month_days in days], axis=-1))
+    results["monthly totals"], timings["monthly totals"] = timed(monthly_totals)
+    results["lifetime streak"], timings["lifetime streak"] = timed(lambda: utils.streak_stats(cube.days).longest)
+    return results, timings
+
+
+def bit_statistics(masks: np.ndarray, num_days: np.ndarray) -> tuple[dict, dict]:
+    """The same statistics for all users at once, with their timings."""
+    results, timings = {}, {}
+    results["days performed"], timings["days performed"] = timed(habit_bits.popcount, masks)
+    results["month streak"], timings["month streak"] = timed(habit_bits.longest_run, masks)
+    results["monthly totals"], timings["monthly totals"] = results["days performed"], timings["days performed"]
+    results["lifetime streak"], timings["lifetime streak"] = timed(habit_bits.longest_streak, masks, num_days)
+    return results, timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--habits", type=int, default=6)
+    parser.add_argument("--first-year", type=int, default=2015)
+    parser.add_argument("--reference-users", type=int, default=20,
+                        help="Users the reference functions run on (their time is extrapolated).")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    num_days = habit_bits.days_in_months(args.first_year, 12 * args.years)
+    masks = random_masks(rng, (args.users, args.habits, 12 * args.years), num_days)
+    print(f"{args.users} users x {args.years} years x {args.habits} habits "
+          f"({masks.nbytes / 1e6:.1f} MB of masks)")
+
+    results, bit_timings = bit_statistics(masks, num_days)
+
+    subset = min(args.reference_users, args.users)
+    reference_timings = dict.fromkeys(results, 0.0)
+    for user in range(subset):
+        expected, timings = reference(masks[user], args.first_year, num_days)
+        for statistic, values in expected.items():
+            if not np.array_equal(values, results[statistic][user]):
+                raise SystemExit(f"{statistic} differs from the reference for user {user}")
+            reference_timings[statistic] += timings[statistic]
+        # The months of a single habit (1-D masks) give the same streak as in the batch
+        for habit in range(args.habits):
+            if habit_bits.longest_streak(masks[user, habit], num_days) != expected["lifetime streak"][habit]:
+                raise SystemExit(f"lifetime streak of a single habit differs from the reference for user {user}")
+
+    scale = args.users / subset
+    print(f"results identical to the reference on {subset} users\n")
+    print(f"{'statistic':<18}{'reference (s, est.)':>22}{'bits (s)':>12}{'speedup':>12}")
+    for statistic, bit_time in bit_timings.items():
+        estimated = reference_timings[statistic] * scale
+        print(f"{statistic:<18}{estimated:>22.2f}{bit_time:>12.3f}{estimated / max(bit_time, 1e-9):>11.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Check and time the ROI overlay compositing of render_overlay against the full-frame composite.
+
+The reference is the compositing render_overlay used before utils.overlay_warped_image: every
+overlay inverse-warped to the full photo size, then its non-black pixels copied over. For every
+photo and threshold, the annotated image rendered both ways must be byte-identical, and so must
+the composite of random noise overlays (every pixel non-black, so the whole destination quad
+and its anti-aliased edges are compared). The exit code is 1 on any difference.
+
+Run from the repository root:
+    python -m benchmarks.overlay
+    python -m benchmarks.overlay photos/ --thresholds 30 50 70 --repeat 10
+
+"""
+import argparse
+import sys
+import time
+from unittest import mock
+
+import cv2
+import numpy as np
+
+import image_ingest
+import omr_engine
+import utils
+from batch_extract import iter_image_paths
+from benchmarks.pipeline import DEFAULT_IMAGES
+
+
+def full_frame_overlay(image: np.ndarray, overlay: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    """The previous compositing: full-frame inverse warp, then a full-frame mask copy."""
+    size = (image.shape[1], image.shape[0])
+    warped = cv2.warpPerspective(overlay, np.linalg.inv(matrix), size)
+    mask = np.any(warped != 0, axis=-1)
+    image[mask] = warped[mask]
+    return image
+
+
+def timed_render(compositor, *args) -> tuple[np.ndarray, float]:
+    """render_overlay with the given compositor, and its wall time."""
+    with mock.patch.object(utils, "overlay_warped_image", compositor):
+        start = time.perf_counter()
+        result = omr_engine.render_overlay(*args)
+        return result, time.perf_counter() - start
+
+
+def differing_pixels(a: np.ndarray, b: np.ndarray) -> int:
+    return int((a != b).any(axis=-1).sum())
+
+
+def check_image(img: np.ndarray,
+                measurement: omr_engine.TemplateMeasurement,
+                year: int,
+                thresholds: list[int],
+                repeat: int,
+                rng: np.random.Generator) -> tuple[int, float, float]:
+    """Differing pixels and summed reference/ROI render times of one photo."""
+    differences, reference_time, roi_time = 0, 0.0, 0.0
+    for threshold in thresholds:
+        binary_array, _, no_of_days = omr_engine.binarize(measurement, year, threshold)
+        args = (img, measurement, binary_array, no_of_days)
+        for _ in range(repeat):
+            expected, elapsed = timed_render(full_frame_overlay, *args)
+            reference_time += elapsed
+            result, elapsed = timed_render(utils.overlay_warped_image, *args)
+            roi_time += elapsed
+        differences += differing_pixels(expected, result)
+
+    layout = measurement.layout
+    for matrix, (width, height) in ((measurement.grid_matrix, layout.grid_size),
+                                    (measurement.stats_matrix, (layout.stats_width, layout.stats_height)),
+                                    (measurement.month_matrix, layout.month_size)):
+        noise = rng.integers(1, 256, size=(height, width, 3), dtype=np.uint8)
+        differences += differing_pixels(full_frame_overlay(img.copy(), noise, matrix),
+                                        utils.overlay_warped_image(img.copy(), noise, matrix))
+    return differences, reference_time, roi_time
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("inputs", nargs="*", help="Images or folders. Defaults to the bundled sample photos.")
+    parser.add_argument("--year", type=int, default=2024)
+    parser.add_argument("--thresholds", type=int, nargs="+", default=[20, 50, 80])
+    parser.add_argument("--repeat", type=int, default=3, help="Renders per photo and threshold that are timed.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    paths = list(iter_image_paths(args.inputs)) if args.inputs else DEFAULT_IMAGES
+    rng = np.random.default_rng(args.seed)
+    failed = 0
+    total_reference, total_roi = 0.0, 0.0
+
+    print(f"{'image':<28}{'full frame (ms)':>18}{'ROI (ms)':>12}{'differing px':>15}")
+    for path in paths:
+        with open(path, "rb") as f:
+            img = image_ingest.decode_image(f.read(), pixel_budget=None).image
+        try:
+            measurement = omr_engine.measure_template(img)
+        except omr_engine.TemplateDetectionError as e:
+            print(f"{path:<28}skipped: {e}")
+            continue
+
+        differences, reference_time, roi_time = check_image(img, measurement, args.year, args.thresholds,
+                                                            args.repeat, rng)
+        renders = len(args.thresholds) * args.repeat
+        total_reference, total_roi = total_reference + reference_time, total_roi + roi_time
+        failed += differences > 0
+        print(f"{path:<28}{reference_time / renders * 1e3:>18.1f}{roi_time / renders * 1e3:>12.1f}{differences:>15}")
+
+    print(f"\n{'identical' if not failed else f'{failed} image(s) differ'}; "
+          f"ROI compositing {total_reference / max(total_roi, 1e-9):.1f}x faster overall")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
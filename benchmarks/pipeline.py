@@ -0,0 +1,264 @@
+"""End-to-end benchmark and accuracy check of the extraction pipeline.
+
+Runs the pipeline (decode included) over the bundled sample photos, or any corpus, N times and
+reports the p50/p95 latency of every stage, the throughput and the peak RSS of the process.
+The extracted month and checkboxes are checked against benchmarks/ground_truth.json, and the
+exit code is 1 if any image disagrees, fails to extract or is missing from the inputs, so the
+script can gate optimizations of the OMR code.
+
+Run from the repository root:
+    python -m benchmarks.pipeline
+    python -m benchmarks.pipeline --repeat 20 --output runs/after.json --compare runs/before.json
+    python -m benchmarks.pipeline synthetic/ --ground-truth synthetic/labels.json
+
+Ground truth files map image paths (relative to the current directory) to the expected
+result of a year: {"assets/example.png": {"year": 2024, "month": 12, "binary_array": [[...]]}}.
+
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import image_ingest
+import omr_engine
+from batch_extract import iter_image_paths, positive_int
+
+DEFAULT_IMAGES = ["assets/example.png"] + [f"assets/test_img{suffix}.jpeg" for suffix in ("", 2, 3, 4, 5, 6, 7)]
+DEFAULT_GROUND_TRUTH = os.path.join(os.path.dirname(__file__), "ground_truth.json")
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of this process."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # kilobytes on Linux
+
+
+def run_image(data: bytes,
+              year: int,
+              percentage_threshold: int,
+              extract_only: bool,
+              detection_max_side: int | None = None) -> omr_engine.ExtractionResult:
+    """Decode and extract one encoded image, with the decode time added to result.timings."""
+    start = time.perf_counter()
+    img = image_ingest.decode_image(data, pixel_budget=None).image
+    decode_time = time.perf_counter() - start
+
+    result = omr_engine.extract_habit_data(img, year, percentage_threshold, detection_max_side, extract_only=extract_only)
+    result.timings = {"decode": decode_time, **result.timings}
+    return result
+
+
+def check_result(result: omr_engine.ExtractionResult, expected: dict) -> dict:
+    """Compare a result with its ground truth entry."""
+    expected_array = np.array(expected["binary_array"])
+    same_shape = expected_array.shape == result.binary_array.shape
+    wrong_cells = int((expected_array != result.binary_array).sum()) if same_shape else int(expected_array.size)
+    return {
+        "month_ok": result.month == expected["month"],
+        "wrong_cells": wrong_cells,
+        "cells": int(expected_array.size),
+        "ok": result.month == expected["month"] and same_shape and wrong_cells == 0,
+    }
+
+
+def failed_check(expected: dict) -> dict:
+    """Accuracy entry of a ground truth image without a result (every cell counts as wrong)."""
+    cells = int(np.array(expected["binary_array"]).size)
+    return {"month_ok": False, "wrong_cells": cells, "cells": cells, "ok": False}
+
+
+def summarize(samples: dict[str, list[float]]) -> dict[str, dict[str, float]]:
+    return {
+        stage: {
+            "p50_ms": float(np.percentile(values, 50) * 1e3),
+            "p95_ms": float(np.percentile(values, 95) * 1e3),
+            "mean_ms": float(np.mean(values) * 1e3),
+        }
+        for stage, values in samples.items()
+    }
+
+
+def run_benchmark(paths: list[str],
+                  ground_truth: dict[str, dict],
+                  year: int,
+                  percentage_threshold: int,
+                  repeat: int,
+                  extract_only: bool,
+                  detection_max_side: int | None = None) -> dict:
+    """Benchmark the pipeline over the images and return the report (JSON-serialisable)."""
+    images = {}
+    for path in paths:
+        with open(path, "rb") as f:
+            images[path] = f.read()
+
+    stage_samples: dict[str, list[float]] = {}
+    per_image = {}
+    processed, busy_time = 0, 0.0
+    for path, data in images.items():
+        expected = ground_truth.get(os.path.normpath(path))
+        image_year = expected["year"] if expected else year
+        try:
+            run_image(data, image_year, percentage_threshold, extract_only, detection_max_side)  # warm-up
+        except (ValueError, cv2.error) as e:
+            # A ground truth image that fails to extract is a failed check, not a skipped one
+            per_image[path] = {"error": str(e), "accuracy": failed_check(expected) if expected else None}
+            continue
+
+        totals = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = run_image(data, image_year, percentage_threshold, extract_only, detection_max_side)
+            totals.append(time.perf_counter() - start)
+            for stage, seconds in result.timings.items():
+                stage_samples.setdefault(stage, []).append(seconds)
+        stage_samples.setdefault("total", []).extend(totals)
+        processed += repeat
+        busy_time += sum(totals)
+
+        per_image[path] = {
+            "month_name": result.month_name,
+            "p50_ms": float(np.percentile(totals, 50) * 1e3),
+            "accuracy": check_result(result, expected) if expected else None,
+        }
+
+    # Ground truth images missing from the inputs fail too, so the gate cannot pass by omission
+    inputs = {os.path.normpath(path) for path in images}
+    for path, expected in ground_truth.items():
+        if path not in inputs:
+            per_image[path] = {"error": "not in the inputs", "accuracy": failed_check(expected)}
+
+    checked = [entry["accuracy"] for entry in per_image.values() if entry.get("accuracy")]
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "settings": {
+            "year": year,
+            "percentage_threshold": percentage_threshold,
+            "repeat": repeat,
+            "extract_only": extract_only,
+            "detection_max_side": detection_max_side,
+            "algorithm_version": omr_engine.ALGORITHM_VERSION,
+        },
+        "stages": summarize(stage_samples),
+        "throughput_images_per_s": processed / busy_time if busy_time else 0.0,
+        "peak_rss_mb": peak_rss_bytes() / (1024 * 1024),
+        "accuracy": {
+            "checked": len(checked),
+            "passed": sum(entry["ok"] for entry in checked),
+            "month_errors": sum(not entry["month_ok"] for entry in checked),
+            "cell_errors": sum(entry["wrong_cells"] for entry in checked),
+            "cells": sum(entry["cells"] for entry in checked),
+        },
+        "images": per_image,
+    }
+
+
+def print_report(report: dict, baseline: dict | None = None) -> None:
+    print(f"{'stage':<12}{'p50 (ms)':>12}{'p95 (ms)':>12}" + (f"{'p50 change':>14}" if baseline else ""))
+    for stage, stats in report["stages"].items():
+        line = f"{stage:<12}{stats['p50_ms']:>12.1f}{stats['p95_ms']:>12.1f}"
+        if baseline and stage in baseline.get("stages", {}):
+            before = baseline["stages"][stage]["p50_ms"]
+            line += f"{(stats['p50_ms'] - before) / before:>+14.0%}" if before else f"{'':>14}"
+        print(line)
+
+    print(f"\nthroughput: {report['throughput_images_per_s']:.1f} images/s (single process)")
+    print(f"peak RSS:   {report['peak_rss_mb']:.0f} MB")
+
+    accuracy = report["accuracy"]
+    print(f"accuracy:   {accuracy['passed']}/{accuracy['checked']} images exact, "
+          f"{accuracy['month_errors']} wrong months, {accuracy['cell_errors']}/{accuracy['cells']} wrong cells")
+    for path, entry in report["images"].items():
+        if "error" in entry:
+            print(f"  {path}: {entry['error']}")
+        elif entry["accuracy"] and not entry["accuracy"]["ok"]:
+            print(f"  {path}: month {'ok' if entry['accuracy']['month_ok'] else 'WRONG'}, "
+                  f"{entry['accuracy']['wrong_cells']} wrong cells")
+
+
+def write_ground_truth(ground_truth: dict[str, dict], output: str) -> None:
+    """Write a ground truth file, one checkbox row per line so it stays reviewable in diffs."""
+    entries = []
+    for path, entry in ground_truth.items():
+        rows = ",\n".join("   " + json.dumps(row) for row in entry["binary_array"])
+        fields = ", ".join(f"{json.dumps(key)}: {json.dumps(entry[key])}" for key in ("year", "month", "month_name"))
+        entries.append(f' {json.dumps(path)}: {{{fields}, "binary_array": [\n{rows}\n  ]}}')
+    with open(output, "w") as f:
+        f.write("{\n" + ",\n".join(entries) + "\n}\n")
+
+
+def record_ground_truth(paths: list[str], year: int, percentage_threshold: int, output: str) -> None:
+    """Write the current pipeline's results as the ground truth (review the overlays before checking it in)."""
+    ground_truth = {}
+    for path in paths:
+        with open(path, "rb") as f:
+            result = run_image(f.read(), year, percentage_threshold, extract_only=True)
+        ground_truth[os.path.normpath(path)] = {
+            "year": year,
+            "month": result.month,
+            "month_name": result.month_name,
+            "binary_array": result.binary_array.tolist(),
+        }
+    write_ground_truth(ground_truth, output)
+    print(f"Recorded {len(ground_truth)} images in {output}")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("inputs", nargs="*", default=DEFAULT_IMAGES,
+                        help="Image files, directories or glob patterns (default: the bundled samples).")
+    parser.add_argument("--year", type=int, default=2024, help="Year of images without ground truth.")
+    parser.add_argument("--threshold", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--extract-only", action="store_true", help="Benchmark the data-only fast path.")
+    parser.add_argument("--detect-max-side", type=positive_int, default=None,
+                        help="Search the template rectangles on a copy downscaled to this longest side.")
+    parser.add_argument("--ground-truth", default=DEFAULT_GROUND_TRUTH)
+    parser.add_argument("--record-ground-truth", action="store_true",
+                        help="Write the current results to --ground-truth instead of benchmarking.")
+    parser.add_argument("-o", "--output", help="Save the report as JSON.")
+    parser.add_argument("--compare", help="A previously saved report to compare the stage latencies with.")
+    args = parser.parse_args(argv)
+
+    paths = list(iter_image_paths(args.inputs))
+    if args.record_ground_truth:
+        record_ground_truth(paths, args.year, args.threshold, args.ground_truth)
+        return 0
+
+    ground_truth = {}
+    if os.path.exists(args.ground_truth):
+        with open(args.ground_truth) as f:
+            ground_truth = {os.path.normpath(path): entry for path, entry in json.load(f).items()}
+
+    report = run_benchmark(paths, ground_truth, args.year, args.threshold, args.repeat, args.extract_only,
+                           args.detect_max_side)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    accuracy = report["accuracy"]
+    return 0 if accuracy["passed"] == accuracy["checked"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
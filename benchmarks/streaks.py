@@ -0,0 +1,69 @@
+"""Benchmark utils.streak_stats against the per-day Python loops it replaced.
+
+The loops are kept here verbatim as the reference: the kernel's longest streaks are checked
+against them on every input before anything is timed.
+
+Run from the repository root:
+    python -m benchmarks.streaks
+    python -m benchmarks.streaks --habits 10 --repeat 50
+
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+import utils
+
+# Day vector lengths of a month, a year and a ten year history
+SPANS = {"month": 31, "year": 366, "lifetime": 3653}
+
+
+def loop_longest_streak(habit_array: np.ndarray) -> np.ndarray:
+    """The former utils.get_longest_streak (also the body of the Monthly Insights longest_streak)."""
+    def calculate_streak(array_column):
+        max_streak = 0
+        current_streak = 0
+        for day in array_column:
+            if day == 1:
+                current_streak += 1
+                max_streak = max(max_streak, current_streak)
+            else:
+                current_streak = 0
+        return max_streak
+
+    return np.array([calculate_streak(habit_array[:, col]) for col in range(habit_array.shape[1])])
+
+
+def median_time(function, argument, repeat: int) -> float:
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(argument)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--habits", type=int, default=6, help="Habit columns per day array.")
+    parser.add_argument("--rate", type=float, default=0.7, help="Probability that a habit was performed on a day.")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'span':<10}{'days':>6}{'loop (ms)':>12}{'kernel (ms)':>14}{'speedup':>10}")
+    for span, num_days in SPANS.items():
+        days = (rng.random((num_days, args.habits)) < args.rate).astype(np.uint8)
+        if not np.array_equal(utils.streak_stats(days).longest, loop_longest_streak(days)):
+            raise SystemExit(f"streak_stats disagrees with the loop on the {span} array")
+
+        loop = median_time(loop_longest_streak, days, args.repeat)
+        kernel = median_time(utils.streak_stats, days, args.repeat)
+        print(f"{span:<10}{num_days:>6}{loop * 1e3:>12.3f}{kernel * 1e3:>14.3f}{loop / kernel:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""Render synthetic photos of filled templates, with exact ground-truth labels.
+
+Every sheet starts from assets/template.jpg (rasterizing template.pdf would need an extra
+dependency). Random checkboxes are marked with a cross, a tick or a scribble and a random
+month is filled in. The page is then "photographed": placed on
+a table, seen in perspective, lit unevenly, held by a thumb on the left tab, blurred,
+sprinkled with sensor noise and saved as a JPEG. The labels are written in the ground-truth
+format of benchmarks.pipeline, so a generated corpus can be benchmarked directly.
+
+Run from the repository root:
+    python -m benchmarks.synthetic synthetic --count 1000 --workers 8
+    python -m benchmarks.pipeline synthetic --ground-truth synthetic/labels.json --repeat 1
+    python batch_extract.py synthetic --year 2024 --no-cache -o results.ndjson
+
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+import omr_engine
+import utils
+from benchmarks.pipeline import write_ground_truth
+from template_layout import DEFAULT_LAYOUT
+
+TEMPLATE_PATH = "assets/template.jpg"
+MONTH_NAMES = ["January", "February", "March", "April", "May", "June",
+               "July", "August", "September", "October", "November", "December"]
+MARKS = ("cross", "tick", "scribble")
+
+# Center of the tab left of the habit name row in assets/template.jpg (template pixels),
+# where people hold the sheet while taking the photo
+TAB_CENTER = (19, 141)
+
+
+@dataclass(frozen=True)
+class TemplateGeometry:
+    """The blank template, upscaled, and where its cells are.
+
+    Attributes:
+        page (np.ndarray): The blank template (BGR) at the rendering scale.
+        tab_center (tuple[float, float]): Center of the left tab in page pixels.
+        cell_boxes (np.ndarray): (rows, cols, 4) x0, y0, x1, y1 of every checkbox in page pixels.
+        month_boxes (np.ndarray): (12, 4) x0, y0, x1, y1 of every month cell in page pixels.
+
+    """
+    page: np.ndarray
+    tab_center: tuple[float, float]
+    cell_boxes: np.ndarray
+    month_boxes: np.ndarray
+
+
+def _boxes_to_page(boxes: np.ndarray, matrix: np.ndarray, scale: float) -> np.ndarray:
+    """Map axis-aligned boxes from a warped region back to page pixels (bounding boxes of the quads)."""
+    x0, y0, x1, y1 = np.moveaxis(boxes.astype(np.float32), -1, 0)
+    corners = np.stack([np.stack([x0, y0], -1), np.stack([x1, y0], -1),
+                        np.stack([x0, y1], -1), np.stack([x1, y1], -1)], axis=-2)
+    page = cv2.perspectiveTransform(corners.reshape(-1, 1, 2), np.linalg.inv(matrix)).reshape(corners.shape) * scale
+    return np.concatenate([page.min(axis=-2), page.max(axis=-2)], axis=-1)
+
+
+def load_geometry(template_path: str = TEMPLATE_PATH, scale: float = 3.0) -> TemplateGeometry:
+    """Upscale the blank template and locate its checkbox and month cells with the extraction engine."""
+    template = omr_engine.read_image(template_path)
+    measurement = omr_engine.measure_template(template)
+    layout = DEFAULT_LAYOUT
+
+    grid_width, grid_height = layout.grid_size
+    cell_w, cell_h = grid_width // layout.checkbox_cols, grid_height // layout.checkbox_rows
+    rows, cols = np.mgrid[0:layout.checkbox_rows, 0:layout.checkbox_cols]
+    cell_boxes = np.stack([cols * cell_w, rows * cell_h, (cols + 1) * cell_w, (rows + 1) * cell_h], axis=-1)
+
+    month_cells = np.arange(12)
+    month_rows = month_cells // layout.month_cols + layout.month_header_rows
+    month_cols = month_cells % layout.month_cols
+    month_boxes = np.stack([month_cols * layout.month_box_width, month_rows * layout.month_box_height,
+                            (month_cols + 1) * layout.month_box_width, (month_rows + 1) * layout.month_box_height],
+                           axis=-1)
+
+    page = cv2.resize(template, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+    return TemplateGeometry(
+        page=page,
+        tab_center=(TAB_CENTER[0] * scale, TAB_CENTER[1] * scale),
+        cell_boxes=_boxes_to_page(cell_boxes, measurement.grid_matrix, scale),
+        month_boxes=_boxes_to_page(month_boxes, measurement.month_matrix, scale),
+    )
+
+
+def _pen_color(rng: np.random.Generator) -> tuple[int, int, int]:
+    """A dark blue, black or dark red ink (BGR)."""
+    base = [(130, 40, 20), (40, 40, 40), (40, 30, 140)][rng.integers(3)]
+    return tuple(int(np.clip(c + rng.integers(-20, 21), 0, 255)) for c in base)
+
+
+def draw_mark(page: np.ndarray, box: np.ndarray, mark: str, rng: np.random.Generator) -> None:
+    """Hand-draw a mark inside a checkbox."""
+    # Stay inside the printed box, ink crossing the grid border would break its outline
+    x0, y0, x1, y1 = box
+    inset_x, inset_y = (x1 - x0) * 0.12, (y1 - y0) * 0.25
+    x0, x1, y0, y1 = x0 + inset_x, x1 - inset_x, y0 + inset_y, y1 - inset_y
+    height = y1 - y0
+    thickness = max(1, int(height * rng.uniform(0.15, 0.3)))
+    color = _pen_color(rng)
+
+    def jitter(points):
+        points = points + rng.normal(0, height * 0.06, points.shape)
+        return np.round(np.clip(points, (x0, y0), (x1, y1))).astype(np.int32)
+
+    if mark == "cross":
+        for line in ([[x0, y0], [x1, y1]], [[x0, y1], [x1, y0]]):
+            cv2.polylines(page, [jitter(np.array(line))], False, color, thickness, cv2.LINE_AA)
+    elif mark == "tick":
+        # A tick is short, so draw it twice as heavy to leave a comparable amount of ink
+        mid_x = x0 + (x1 - x0) * rng.uniform(0.3, 0.45)
+        points = np.array([[x0 + (x1 - x0) * 0.15, y0 + height * 0.5], [mid_x, y1], [x1, y0]])
+        cv2.polylines(page, [jitter(points)], False, color, thickness * 2, cv2.LINE_AA)
+    else:
+        # Zigzag hatching across the whole box
+        strokes = rng.integers(8, 16)
+        xs = np.linspace(x0, x1, strokes)
+        ys = np.where(np.arange(strokes) % 2, y1, y0)
+        cv2.polylines(page, [jitter(np.stack([xs, ys], axis=-1))], False, color, thickness, cv2.LINE_AA)
+
+
+def draw_month(page: np.ndarray, box: np.ndarray, rng: np.random.Generator) -> None:
+    """Fill in the month cell, as users do (a blob of ink over the month name)."""
+    x0, y0, x1, y1 = box
+    center = (int((x0 + x1) / 2 + rng.normal(0, (x1 - x0) * 0.05)), int((y0 + y1) / 2))
+    axes = (int((x1 - x0) * rng.uniform(0.25, 0.4)), int((y1 - y0) * rng.uniform(0.3, 0.45)))
+    cv2.ellipse(page, center, axes, rng.uniform(-20, 20), 0, 360, _pen_color(rng), -1, cv2.LINE_AA)
+
+
+def draw_thumb(photo: np.ndarray, tip: np.ndarray, width: float, rng: np.random.Generator) -> None:
+    """A thumb reaching in from the left edge of the photo, its tip on the given point."""
+    skin = tuple(int(c) for c in np.array([140, 170, 220]) * rng.uniform(0.75, 1.05))
+    thickness = int(width * rng.uniform(0.05, 0.07))
+    entry = (-thickness, int(tip[1] + width * rng.uniform(-0.1, 0.1)))
+    tip = (int(tip[0] + width * rng.uniform(-0.01, 0.01)), int(tip[1]))
+    cv2.line(photo, entry, tip, skin, thickness, cv2.LINE_AA)
+    cv2.circle(photo, tip, thickness // 2, skin, -1, cv2.LINE_AA)
+
+
+def _luma_noise(shape: tuple[int, int], sigma: float) -> np.ndarray:
+    """Gaussian noise shared by the three channels (float32, HxWx1)."""
+    noise = np.empty(shape, np.float32)
+    cv2.randn(noise, 0, sigma)
+    return noise[..., None]
+
+
+def photograph(page: np.ndarray, tab_center: tuple[float, float], rng: np.random.Generator) -> np.ndarray:
+    """Place the page on a table and simulate a phone photo of it.
+
+    Most photos show a thumb holding the sheet by its left tab or cut the sheet at the frame
+    edges: both break the outline of the paper, as in real photos. Photos with the whole sheet
+    visible and nothing in front of it are rare and the detector is known to struggle with them.
+
+    """
+    height, width = page.shape[:2]
+    margin = int(width * rng.uniform(-0.02, 0.12))
+    canvas_size = (width + 2 * margin, height + 2 * margin)
+    cv2.setRNGSeed(int(rng.integers(2**31)))
+
+    # A light table (desk, bed sheet) with some texture
+    table = rng.integers(120, 231) + rng.integers(-25, 26, 3)
+    photo = np.empty((canvas_size[1], canvas_size[0], 3), np.uint8)
+    cv2.randn(photo, table.astype(np.float64), np.full(3, 6.0))
+
+    # Perspective: move the page corners by up to 4% of the page width
+    src = np.float32([[0, 0], [width, 0], [0, height], [width, height]])
+    dst = src + margin + rng.uniform(-0.04, 0.04, (4, 2)).astype(np.float32) * width
+    matrix = cv2.getPerspectiveTransform(src, dst)
+    cv2.warpPerspective(page, matrix, canvas_size, dst=photo, flags=cv2.INTER_LINEAR,
+                        borderMode=cv2.BORDER_TRANSPARENT)
+    if margin > 0 and rng.random() < 0.85:
+        tip = cv2.perspectiveTransform(np.float32([[tab_center]]), matrix)[0, 0]
+        draw_thumb(photo, tip, width, rng)
+
+    # Uneven lighting: a linear gradient in a random direction
+    angle = rng.uniform(0, 2 * np.pi)
+    ramp = np.add.outer(np.sin(angle) * np.linspace(0, 1, canvas_size[1], dtype=np.float32),
+                        np.cos(angle) * np.linspace(0, 1, canvas_size[0], dtype=np.float32))
+    ramp = (ramp - ramp.min()) / (np.ptp(ramp) or 1)
+    low = rng.uniform(0.55, 0.9)
+    lit = photo * (low + (1.05 - low) * ramp)[..., None]
+
+    # Optics and sensor
+    sigma = rng.uniform(0, 1.5)
+    if sigma > 0.3:
+        lit = cv2.GaussianBlur(lit, (0, 0), sigma)
+    lit += _luma_noise(lit.shape[:2], rng.uniform(1, 6))
+    return np.clip(lit, 0, 255).astype(np.uint8)
+
+
+def generate_sheet(geometry: TemplateGeometry, year: int, seed: int, index: int) -> tuple[bytes, dict]:
+    """Render one synthetic photo. Returns the JPEG bytes and its ground-truth labels."""
+    rng = np.random.default_rng([seed, index])
+    month = int(rng.integers(1, 13))
+    month_name = MONTH_NAMES[month - 1]
+    no_of_days = utils.get_days_in_month(year, month_name)
+
+    # Each habit gets its own completion rate, some are hardly ever done
+    rates = rng.beta(2, 2, size=geometry.cell_boxes.shape[1])
+    binary_array = (rng.random((no_of_days, len(rates))) < rates).astype(int)
+
+    page = geometry.page.copy()
+    habit_marks = rng.choice(MARKS, size=len(rates))
+    for day, habit in np.argwhere(binary_array):
+        mark = habit_marks[habit] if rng.random() < 0.9 else rng.choice(MARKS)
+        draw_mark(page, geometry.cell_boxes[day, habit], mark, rng)
+    draw_month(page, geometry.month_boxes[month - 1], rng)
+
+    # Printers leave a white margin around the template
+    border = int(page.shape[1] * 0.04)
+    page = cv2.copyMakeBorder(page, border, border, border, border, cv2.BORDER_CONSTANT, value=(245, 245, 245))
+    tab_center = (geometry.tab_center[0] + border, geometry.tab_center[1] + border)
+
+    photo = photograph(page, tab_center, rng)
+    quality = int(rng.integers(55, 96))
+    _, encoded = cv2.imencode(".jpg", photo, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    labels = {"year": year, "month": month, "month_name": month_name, "binary_array": binary_array.tolist()}
+    return encoded.tobytes(), labels
+
+
+_geometry: TemplateGeometry | None = None
+
+
+def _init_worker(template_path: str, scale: float) -> None:
+    global _geometry
+    cv2.setNumThreads(1)
+    _geometry = load_geometry(template_path, scale)
+
+
+def _render(output_dir: str, year: int, seed: int, index: int) -> tuple[str, dict]:
+    data, labels = generate_sheet(_geometry, year, seed, index)
+    path = os.path.normpath(os.path.join(output_dir, f"synthetic_{index:06d}.jpg"))
+    with open(path, "wb") as f:
+        f.write(data)
+    return path, labels
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output_dir", help="Directory for the images and labels.json.")
+    parser.add_argument("-n", "--count", type=int, default=100, help="Number of sheets (default: 100).")
+    parser.add_argument("--year", type=int, default=2024, help="Year of the sheets (sets the month lengths).")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed, the same seed renders the same sheets.")
+    parser.add_argument("--scale", type=float, default=3.0,
+                        help="Rendering scale of the 595x842 template (default: 3, a ~4.5 MP page).")
+    parser.add_argument("--template", default=TEMPLATE_PATH)
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Worker processes (default: CPU count).")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    workers = args.workers or os.cpu_count() or 1
+    labels = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(args.template, args.scale)) as executor:
+        jobs = [executor.submit(_render, args.output_dir, args.year, args.seed, index) for index in range(args.count)]
+        for job in jobs:
+            path, image_labels = job.result()
+            labels[path] = image_labels
+
+    labels_path = os.path.join(args.output_dir, "labels.json")
+    write_ground_truth(labels, labels_path)
+    print(f"Rendered {len(labels)} sheets into {args.output_dir}, labels in {labels_path}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,271 @@
+import calendar
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+
 import firebase_admin
 import streamlit as st
 from firebase_admin import credentials, firestore
 
+import habit_aggregates
+import utils
+
+# Document fields starting with "_" are reserved (not years) and are stripped on read
+FORMAT_FIELD = "_format"
+AGGREGATES_FIELD = "_aggregates"  # {year: {month: {habit: summary}}}, see habit_aggregates
+MANIFEST_FIELD = "_manifest"      # {year: {month: [habit names]}}
+LAYOUT_FIELD = "_layout"
+LIST_FORMAT = 1     # each habit-month is a list with a 0/1 per day
+BITMASK_FORMAT = 2  # each habit-month is an integer bitmask, day 1 in the lowest bit
+NESTED_LAYOUT = 1   # the years are fields of the user document
+YEARS_LAYOUT = 2    # each year is a document of the user's "years" subcollection, the user
+                    # document keeps the manifest and the aggregates
+YEARS_COLLECTION = "years"
+
+# Seconds a session reuses what it read from a user document before reading it again (writes
+# of other sessions show up after at most this long, writes of the session itself immediately)
+USER_DOCUMENT_TTL = 600
+_SESSION_READS_KEY = "firestore_reads"
+
+
+@dataclass
+class UserYear:
+    """One year of a user document, read without the other years.
+
+    Attributes:
+        data (dict): The habit data of the year, {month: {habit: [0/1 per day]}}.
+        aggregates (dict): The habit-month aggregates of the year, {month: {habit: summary}}.
+        update_time (object): Update time of the document (None if it does not exist).
+
+    """
+    data: dict = field(default_factory=dict)
+    aggregates: dict = field(default_factory=dict)
+    update_time: object = None
+
 
+@st.cache_resource(show_spinner=False)
 def initialize_firestore():
+    """The Firestore client of the server process, created on the first call and shared by all
+    pages and sessions (the client is thread-safe and reuses its channel and credentials)."""
     if not firebase_admin._apps:
         cred = credentials.Certificate(dict(st.secrets["firebase"]))
         firebase_admin.initialize_app(cred)
     return firestore.client()
 
+@st.cache_resource(show_spinner=False)
+def warm_up_firestore() -> threading.Thread:
+    """Open the connection of the shared client in the background, once per server process.
+
+    A read of a (missing) document sets up the gRPC channel and fetches the credentials'
+    access token, so the first request of a user does not wait for them.
+    """
+    db = initialize_firestore()
+
+    def warm_up():
+        try:
+            db.collection("users").document("_warm_up").get(field_paths=[FORMAT_FIELD])
+        except Exception as e:
+            print(f"An error occurred while warming up Firestore: {e}")
+
+    thread = threading.Thread(target=warm_up, name="firestore-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+def field_path(*fields: str) -> str:
+    """Field path of nested fields for read masks (field_paths), quoted where Firestore needs it (e.g. years)."""
+    return firestore.FieldPath(*fields).to_api_repr()
+
+def packed_storage_enabled() -> bool:
+    """Whether new habit-months are stored as bitmasks (CONSISTIFY_PACKED_STORAGE=1), off by default."""
+    return os.environ.get("CONSISTIFY_PACKED_STORAGE", "").lower() in ("1", "true", "yes")
+
+def sharded_storage_enabled() -> bool:
+    """Whether new users get the years layout (CONSISTIFY_SHARDED_STORAGE=1), off by default.
+
+    Existing users keep their layout until they are migrated with
+    helpful-scripts/14_migrate_to_year_documents.py.
+    """
+    return os.environ.get("CONSISTIFY_SHARDED_STORAGE", "").lower() in ("1", "true", "yes")
+
+def document_layout(stored: dict | None) -> int:
+    """Layout of a stored user document (None if it does not exist yet, it then gets the configured layout).
+
+    Projected reads must include LAYOUT_FIELD.
+    """
+    if stored is None:
+        return YEARS_LAYOUT if sharded_storage_enabled() else NESTED_LAYOUT
+    return stored.get(LAYOUT_FIELD, NESTED_LAYOUT)
+
+def year_document(user_ref, year: str):
+    """Reference of the document holding a year of the user in the years layout."""
+    return user_ref.collection(YEARS_COLLECTION).document(str(year))
+
+def encode_user_data(user_data: dict, packed: bool | None = None) -> dict:
+    """Encode {year: {month: {habit: [0/1 per day]}}} for storage.
+
+    Args:
+        user_data (dict): The habit data to store.
+        packed (bool | None, optional): Store each habit-month as a 32-bit bitmask instead of
+        a list, and mark the document with FORMAT_FIELD. Defaults to packed_storage_enabled().
+
+    Returns:
+        dict: The document fields to write.
+
+    """
+    if packed is None:
+        packed = packed_storage_enabled()
+    if not packed:
+        return user_data
+
+    encoded = {
+        year: {
+            month: {habit: utils.pack_days(days) for habit, days in habit_days.items()}
+            for month, habit_days in year_data.items()
+        }
+        for year, year_data in user_data.items()
+    }
+    encoded[FORMAT_FIELD] = BITMASK_FORMAT
+    return encoded
+
+def decode_month(year: str, month: str, habit_days: dict) -> dict:
+    """Decode the habits of one stored month into {habit: [0/1 per day]}.
+
+    Bitmasks are unpacked to the number of days in the month, lists are returned as they are,
+    so documents written before the bitmask format keep working.
+
+    """
+    num_days = calendar.monthrange(int(year), list(calendar.month_name).index(month))[1]
+    return {
+        habit: utils.unpack_days(days, num_days) if isinstance(days, int) else days
+        for habit, days in habit_days.items()
+    }
+
+def check_format(stored: dict) -> None:
+    """Raise a ValueError if a stored document was written in a format newer than this code understands."""
+    if stored.get(FORMAT_FIELD, LIST_FORMAT) > BITMASK_FORMAT:
+        raise ValueError(f"Unsupported storage format {stored[FORMAT_FIELD]}, please update the app.")
+
+def read_year_document(snapshot) -> dict:
+    """The stored months of a year document snapshot, {month: {habit: days}} ({} if it does not exist)."""
+    stored = snapshot.to_dict() if snapshot.exists else None
+    if not stored:
+        return {}
+    check_format(stored)
+    return {month: habit_days for month, habit_days in stored.items() if not month.startswith("_")}
+
+def decode_user_data(user_data: dict | None) -> dict | None:
+    """Decode a stored user document into {year: {month: {habit: [0/1 per day]}}}.
+
+    Reserved fields (starting with "_") are removed.
+
+    Raises:
+        ValueError: If the document was written in a format newer than this code understands.
+
+    """
+    if user_data is None:
+        return None
+    check_format(user_data)
+    return {
+        year: {month: decode_month(year, month, habit_days) for month, habit_days in year_data.items()}
+        for year, year_data in user_data.items() if not year.startswith("_")
+    }
+
+def _session_read(user_email: str, name: tuple, read, ttl: float):
+    """Return the session's cached result of read() for the user, calling it when missing or older than ttl.
+
+    Streamlit reruns the page scripts on every widget change, the reruns then cost no reads.
+    The write functions below drop the user's cached reads (invalidate_user_document).
+    """
+    reads = st.session_state.setdefault(_SESSION_READS_KEY, {})
+    cached = reads.get((user_email, *name))
+    if cached is not None and time.monotonic() - cached[0] < ttl:
+        return cached[1]
+    value = read()
+    reads[(user_email, *name)] = (time.monotonic(), value)
+    return value
+
+def invalidate_user_document(user_email: str) -> None:
+    """Drop everything the session cached from a user document, the next loads read it again."""
+    reads = st.session_state.get(_SESSION_READS_KEY, {})
+    for key in [key for key in reads if key[0] == user_email]:
+        del reads[key]
+
+def build_manifest(user_data: dict) -> dict:
+    """Manifest ({year: {month: [habit names]}}) of stored (or decoded) user data."""
+    return {
+        year: {month: sorted(habit_days) for month, habit_days in year_data.items()}
+        for year, year_data in user_data.items() if not year.startswith("_")
+    }
+
+def load_manifest(db, user_email: str, ttl: float = USER_DOCUMENT_TTL) -> dict:
+    """The years, months and habits a user has data for, {year: {month: [habit names]}}.
+
+    Only the manifest field is read (cached per session), so the dropdowns and existence
+    checks do not download the habit data. Documents last written before the manifest
+    existed are read in full once per session instead.
+
+    """
+    def read():
+        doc = db.collection("users").document(user_email).get(field_paths=[MANIFEST_FIELD])
+        if not doc.exists:
+            return {}
+        manifest = doc.to_dict().get(MANIFEST_FIELD)
+        if manifest is None:
+            return build_manifest(db.collection("users").document(user_email).get().to_dict() or {})
+        return manifest
+
+    return _session_read(user_email, ("manifest",), read, ttl)
+
+def month_exists(db, user_email: str, year: str, month_name: str) -> bool:
+    """Whether the user has data for the month (from the manifest)."""
+    return month_name in load_manifest(db, user_email).get(str(year), {})
+
+def load_year(db, user_email: str, year: str, ttl: float = USER_DOCUMENT_TTL) -> UserYear:
+    """The habit data and aggregates of one year, read with a field mask (cached per session).
+
+    In the years layout this reads the year's document and the year's aggregates, so the
+    cost does not grow with the number of years stored.
+    """
+    year = str(year)
+
+    def read():
+        user_ref = db.collection("users").document(user_email)
+        field_paths = [field_path(year), field_path(AGGREGATES_FIELD, year), FORMAT_FIELD, LAYOUT_FIELD]
+        doc = user_ref.get(field_paths=field_paths)
+        if not doc.exists:
+            return UserYear()
+        stored = doc.to_dict()
+        if document_layout(stored) == YEARS_LAYOUT:
+            stored[year] = read_year_document(year_document(user_ref, year).get())
+        return UserYear(
+            decode_user_data(stored).get(year, {}),
+            get_aggregates(stored).get(year, {}),
+            doc.update_time,
+        )
+
+    return _session_read(user_email, ("year", year), read, ttl)
+
+def load_aggregates(db, user_email: str, ttl: float = USER_DOCUMENT_TTL) -> dict:
+    """The aggregates of all years, {year: {month: {habit: summary}}}, without the habit data.
+
+    Years whose aggregates are missing or incomplete (written before they were maintained)
+    are summarized from their data, read with load_year.
+
+    """
+    def read():
+        doc = db.collection("users").document(user_email).get(field_paths=[AGGREGATES_FIELD])
+        stored = (doc.to_dict() or {}).get(AGGREGATES_FIELD, {}) if doc.exists else {}
+        aggregates = {}
+        for year, months in load_manifest(db, user_email, ttl).items():
+            if year in stored and set(stored[year]) == set(months):
+                aggregates[year] = stored[year]
+            else:
+                aggregates[year] = load_year(db, user_email, year, ttl).aggregates
+        return aggregates
+
+    return _session_read(user_email, ("aggregates",), read, ttl)
+
 def delete_data_for_year_month(db, user_email, year, month):
     """Deletes data for a specific year and month from a user's document in Firestore.
     
@@ -22,49 +279,216 @@ def delete_data_for_year_month(db, user_email, year, month):
         # Reference the Firestore document for the user
         user_ref = db.collection("users").document(user_email)
 
-        # Build the path to the specific year and month
-        field_path = f"{year}.{month}"
-
-        # Use Firestore's update method with DELETE_FIELD to remove the data
-        from google.cloud.firestore_v1 import DELETE_FIELD
-        user_ref.update({
-            field_path: DELETE_FIELD,
-        })
+        # Remove the month and its aggregates in one transaction, the later year-to-date sums change too
+        _delete_month_with_aggregates(db.transaction(), user_ref, str(year), month)
 
         print(f"Data for {year}, {month} has been successfully deleted.")
     except Exception as e:
         print(f"An error occurred while deleting data: {e}")
+    finally:
+        invalidate_user_document(user_email)
+
+
+@firestore.transactional
+def _delete_month_with_aggregates(transaction, user_ref, year: str, month: str) -> None:
+    from google.cloud.firestore_v1 import DELETE_FIELD
+
+    snapshot = user_ref.get(field_paths=[field_path(AGGREGATES_FIELD, year), LAYOUT_FIELD], transaction=transaction)
+    stored = snapshot.to_dict() if snapshot.exists else None
+    year_aggregates = (stored or {}).get(AGGREGATES_FIELD, {}).get(year, {})
+    year_aggregates.pop(month, None)
+
+    # Use Firestore's update method with DELETE_FIELD to remove the data
+    updates = {
+        f"{AGGREGATES_FIELD}.{year}": habit_aggregates.update_year_to_date(year_aggregates) or DELETE_FIELD,
+        f"{MANIFEST_FIELD}.{year}.{month}": DELETE_FIELD,
+    }
+    if document_layout(stored) == YEARS_LAYOUT:
+        transaction.update(year_document(user_ref, year), {month: DELETE_FIELD})
+    else:
+        updates[f"{year}.{month}"] = DELETE_FIELD
+    transaction.update(user_ref, updates)
 
 
 def get_user_data(db, user_email, year, month_name):
-    """Retrieve user data for a specific year and month from Firestore.
+    """Retrieve user data for a specific year and month from Firestore (only that month is read).
     """
-    doc = db.collection("users").document(user_email).get()
+    user_ref = db.collection("users").document(user_email)
+    field_paths = [field_path(str(year), month_name), FORMAT_FIELD, LAYOUT_FIELD]
+    doc = user_ref.get(field_paths=field_paths)
     if doc.exists:
         user_data = doc.to_dict()
+        if document_layout(user_data) == YEARS_LAYOUT:
+            year_doc = year_document(user_ref, year).get(field_paths=[field_path(month_name), FORMAT_FIELD])
+            user_data = {str(year): read_year_document(year_doc)}
         if str(year) in user_data and month_name in user_data[str(year)]:
-            return user_data[str(year)][month_name]
+            return decode_month(str(year), month_name, user_data[str(year)][month_name])
     return None
 
 
 def store_user_data(db, user_email, user_data):
-    """Store user data in Firestore.
+    """Store user data in Firestore (as bitmasks when packed storage is enabled).
+
+    The aggregates of the written habit-months, and the year-to-date sums of their years,
+    are updated in the same transaction. In the years layout the habit-months are written
+    to their year documents.
     """
-    db.collection("users").document(user_email).set(user_data, merge=True)
+    user_ref = db.collection("users").document(user_email)
+    try:
+        _store_with_aggregates(db.transaction(), user_ref, user_data)
+    finally:
+        invalidate_user_document(user_email)
 
 
-def get_all_user_data(db, user_email: str)->dict:
-    """Fetches the user's data from Firestore.
-    
+def upsert_month(db, user_email: str, year: str, month_name: str, habit_data: dict) -> None:
+    """Store a month of habit data, replacing the month if it is already stored.
+
+    The month, its aggregates and the manifest are written in one transaction (a single
+    commit), so other readers see either the old or the new month, never no month.
+
     Args:
         user_email (str): The user email.
-    
+        year (str): The year (e.g., "2020").
+        month_name (str): The month (e.g., "January").
+        habit_data (dict): The habits of the month, {habit: [0/1 per day]}.
+
+    """
+    user_ref = db.collection("users").document(user_email)
+    try:
+        _store_with_aggregates(db.transaction(), user_ref, {str(year): {month_name: habit_data}}, replace=True)
+    finally:
+        invalidate_user_document(user_email)
+
+
+@firestore.transactional
+def _store_with_aggregates(transaction, user_ref, user_data: dict, replace: bool = False) -> None:
+    field_paths = [path for year in user_data for path in (field_path(year), field_path(AGGREGATES_FIELD, year))]
+    snapshot = user_ref.get(field_paths=field_paths + [MANIFEST_FIELD, LAYOUT_FIELD], transaction=transaction)
+    layout = document_layout(snapshot.to_dict() if snapshot.exists else None)
+    stored = (snapshot.to_dict() or {}) if snapshot.exists else {}
+    year_snapshots = {}
+    if layout == YEARS_LAYOUT:
+        for year in user_data:
+            year_snapshots[year] = year_document(user_ref, year).get(transaction=transaction)
+            stored[year] = read_year_document(year_snapshots[year])
+
+    manifest = stored.get(MANIFEST_FIELD)
+    if manifest is None:
+        # Last written before the manifest existed, list everything once
+        manifest = build_manifest(user_ref.get(transaction=transaction).to_dict() or {}) if snapshot.exists else {}
+
+    aggregates = {}
+    for year, year_data in user_data.items():
+        year_aggregates = stored.get(AGGREGATES_FIELD, {}).get(year, {})
+        stored_months = stored.get(year, {})
+        if set(year_aggregates) != set(stored_months):
+            # The year was (partly) written before aggregates were maintained, summarize it again
+            year_aggregates = get_year_aggregates(year, stored_months)
+        if replace:
+            year_aggregates = {month: habits for month, habits in year_aggregates.items() if month not in year_data}
+        aggregates[year] = habit_aggregates.merge_months(year_aggregates, year_data)
+
+        # set(merge=True) merges the habits of a month, so the manifest lists both
+        year_manifest = manifest.setdefault(year, {})
+        for month, habit_days in year_data.items():
+            habits = set(habit_days) if replace else set(year_manifest.get(month, [])) | set(habit_days)
+            year_manifest[month] = sorted(habits)
+
+    encoded = dict(encode_user_data(user_data))  # popped from below, user_data itself when not packed
+    format_fields = {FORMAT_FIELD: encoded.pop(FORMAT_FIELD)} if FORMAT_FIELD in encoded else {}
+    if layout == YEARS_LAYOUT:
+        # The habit-months go to the year documents (with the format marker), the rest stays here
+        for year in user_data:
+            year_fields = {**encoded.pop(year), **format_fields}
+            if replace and year_snapshots[year].exists:
+                transaction.update(year_document(user_ref, year), year_fields)
+            else:
+                transaction.set(year_document(user_ref, year), year_fields, merge=True)
+        format_fields = {}
+
+    if replace and snapshot.exists:
+        # update() replaces the maps of the written months instead of merging their habits into them
+        transaction.update(user_ref, {
+            **{f"{year}.{month}": habit_days for year, year_data in encoded.items() for month, habit_days in year_data.items()},
+            **{f"{AGGREGATES_FIELD}.{year}": year_aggregates for year, year_aggregates in aggregates.items()},
+            **format_fields,
+            MANIFEST_FIELD: manifest,
+            LAYOUT_FIELD: layout,
+        })
+    else:
+        transaction.set(
+            user_ref,
+            {**encoded, **format_fields, AGGREGATES_FIELD: aggregates, MANIFEST_FIELD: manifest, LAYOUT_FIELD: layout},
+            merge=True,
+        )
+
+
+def migrate_to_year_documents(db, user_email: str) -> bool:
+    """Move a user from the nested layout to the years layout, in one transaction.
+
+    The years are copied to their documents and removed from the user document, which gets
+    its manifest and aggregates (re)built, so a user is either migrated or not and the
+    migration can be interrupted and run again.
+
+    Args:
+        user_email (str): The user email.
+
     Returns:
-        dict: The user's data or None if not found.
+        bool: Whether the user was migrated (False if there is no document or it already uses the years layout).
 
     """
-    doc = db.collection("users").document(user_email).get()
-    return doc.to_dict() if doc.exists else None
+    return _migrate_user(db.transaction(), db.collection("users").document(user_email))
+
+
+@firestore.transactional
+def _migrate_user(transaction, user_ref) -> bool:
+    from google.cloud.firestore_v1 import DELETE_FIELD
+
+    snapshot = user_ref.get(transaction=transaction)
+    if not snapshot.exists or document_layout(snapshot.to_dict()) == YEARS_LAYOUT:
+        return False
+    stored = snapshot.to_dict()
+    check_format(stored)
+
+    years = [year for year in stored if not year.startswith("_")]
+    year_fields = {FORMAT_FIELD: stored[FORMAT_FIELD]} if FORMAT_FIELD in stored else {}
+    for year in years:
+        transaction.set(year_document(user_ref, year), {**stored[year], **year_fields})
+    transaction.update(user_ref, {
+        **{year: DELETE_FIELD for year in years},
+        FORMAT_FIELD: DELETE_FIELD,
+        AGGREGATES_FIELD: get_aggregates(stored),
+        MANIFEST_FIELD: build_manifest(stored),
+        LAYOUT_FIELD: YEARS_LAYOUT,
+    })
+    return True
+
+
+def get_year_aggregates(year: str, year_data: dict) -> dict:
+    """Aggregates of a year of stored (possibly bit-packed) raw data."""
+    return habit_aggregates.build_year_aggregates(
+        {month: decode_month(year, month, habit_days) for month, habit_days in year_data.items()},
+    )
+
+
+def get_aggregates(user_data: dict | None) -> dict:
+    """The aggregates of a stored user document, {year: {month: {habit: summary}}}.
+
+    Years written before aggregates were maintained are summarized from their raw data.
+    """
+    if not user_data:
+        return {}
+    stored = user_data.get(AGGREGATES_FIELD, {})
+    aggregates = {}
+    for year, year_data in user_data.items():
+        if year.startswith("_"):
+            continue
+        if year in stored and set(stored[year]) == set(year_data):
+            aggregates[year] = stored[year]
+        else:
+            aggregates[year] = get_year_aggregates(year, year_data)
+    return aggregates
+
 
 def delete_data_for_year(db, user_email: str, year: str)->None:
     """Deletes all data for a specific year from a user's document in Firestore.
@@ -78,15 +502,23 @@ def delete_data_for_year(db, user_email: str, year: str)->None:
         # Reference the Firestore document for the user
         user_ref = db.collection("users").document(user_email)
 
-        # Use Firestore's update method with DELETE_FIELD to remove the year data
+        # Use Firestore's update method with DELETE_FIELD to remove the year data, and delete
+        # the year's document of the years layout in the same batch
         from google.cloud.firestore_v1 import DELETE_FIELD
-        user_ref.update({
+        batch = db.batch()
+        batch.update(user_ref, {
             year: DELETE_FIELD,
+            f"{AGGREGATES_FIELD}.{year}": DELETE_FIELD,
+            f"{MANIFEST_FIELD}.{year}": DELETE_FIELD,
         })
+        batch.delete(year_document(user_ref, year))
+        batch.commit()
 
         print(f"Data for {year} has been successfully deleted for user {user_email}.")
     except Exception as e:
         print(f"An error occurred while deleting data: {e}")
+    finally:
+        invalidate_user_document(user_email)
 
 
 def delete_all_user_data(db, user_email: str)->None:
@@ -100,9 +532,11 @@ def delete_all_user_data(db, user_email: str)->None:
         # Reference the Firestore document for the user
         user_ref = db.collection("users").document(user_email)
 
-        # Delete the entire document
-        user_ref.delete()
+        # Delete the entire document with its year documents (in batches)
+        db.recursive_delete(user_ref)
 
         print(f"All data for user {user_email} has been successfully deleted.")
     except Exception as e:
-        print(f"An error occurred while deleting all data for user {user_email}: {e}")
\ No newline at end of file
+        print(f"An error occurred while deleting all data for user {user_email}: {e}")
+    finally:
+        invalidate_user_document(user_email)
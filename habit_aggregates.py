@@ -0,0 +1,131 @@
+"""Precomputed per habit-month statistics, stored next to the raw data in the `_aggregates` field.
+
+Every habit-month is summarized as
+
+    {"days": 31, "total": 23, "lead": 4, "trail": 2, "best": 9, "ytd": 61}
+
+(number of days stored, days performed, run starting on day 1, run ending on the last day,
+longest run, and days performed from January 1st to the end of the month). The aggregates
+of a user are nested like the raw data, {year: {month: {habit: summary}}}, and
+firebase_utils keeps them up to date on every write, so the insights pages get month totals,
+year-to-date sums and streaks in O(months) without reading the day arrays. Streaks are
+joined across months and years with streak_summary.StreakSummary.
+
+Example:
+    >>> year_aggregates = build_year_aggregates({"January": {"Read": [1, 1, 0, 1]}, "February": {"Read": [1, 1]}})
+    >>> year_aggregates["February"]["Read"]
+    {'days': 2, 'total': 2, 'lead': 2, 'trail': 2, 'best': 2, 'ytd': 5}
+    >>> year_streak({"2024": year_aggregates}, "2024", "Read")
+    3
+
+"""
+import calendar
+
+import numpy as np
+
+from streak_summary import StreakSummary, StreakTree
+
+MONTH_NAMES = list(calendar.month_name)[1:]
+
+
+def month_summary(days: list[int] | np.ndarray) -> dict[str, int]:
+    """Summarize the day vector of one habit-month (without the year-to-date sum)."""
+    days = np.asarray(days) != 0
+    streaks = StreakSummary.from_days(days)
+    return {
+        "days": streaks.length,
+        "total": int(days.sum()),
+        "lead": streaks.prefix,
+        "trail": streaks.suffix,
+        "best": streaks.best,
+    }
+
+
+def update_year_to_date(year_aggregates: dict) -> dict:
+    """(Re)compute the "ytd" sums of every habit-month of a year, in place."""
+    running: dict[str, int] = {}
+    for month in MONTH_NAMES:
+        for habit, summary in year_aggregates.get(month, {}).items():
+            running[habit] = running.get(habit, 0) + summary["total"]
+            summary["ytd"] = running[habit]
+    return year_aggregates
+
+
+def build_year_aggregates(year_data: dict) -> dict:
+    """Aggregates of a year of raw data ({month: {habit: [0/1 per day]}})."""
+    year_aggregates = {
+        month: {habit: month_summary(days) for habit, days in habit_days.items()}
+        for month, habit_days in year_data.items() if month in MONTH_NAMES
+    }
+    return update_year_to_date(year_aggregates)
+
+
+def merge_months(year_aggregates: dict, year_data: dict) -> dict:
+    """Aggregates of a year after the habit-months of year_data are written (merged) into it.
+
+    Only the written habit-months are summarized again, the year-to-date sums of the year
+    are then recomputed from the month totals.
+
+    """
+    merged = {month: {habit: dict(summary) for habit, summary in habits.items()}
+              for month, habits in year_aggregates.items()}
+    for month, habit_days in year_data.items():
+        merged.setdefault(month, {}).update({habit: month_summary(days) for habit, days in habit_days.items()})
+    return update_year_to_date(merged)
+
+
+def monthly_totals(year_aggregates: dict, habit: str) -> list[int]:
+    """Days performed in each month of the year (12 values, 0 for months without data)."""
+    return [year_aggregates.get(month, {}).get(habit, {}).get("total", 0) for month in MONTH_NAMES]
+
+
+def year_to_date(year_aggregates: dict, month: str, habit: str) -> int:
+    """Days performed from January 1st to the end of the month (0 if the habit-month has no data)."""
+    return year_aggregates.get(month, {}).get(habit, {}).get("ytd", 0)
+
+
+def month_streaks(aggregates: dict, habit: str) -> tuple[int, list[StreakSummary]]:
+    """Streak summaries of every calendar month, from January of the first year with data to
+    December of the last one (months without data for the habit are gaps of their length).
+
+    Returns:
+        tuple[int, list[StreakSummary]]: The first year and the summaries, 12 per year.
+
+    """
+    years = sorted(int(year) for year in aggregates)
+    if not years:
+        return 0, []
+    summaries = []
+    for year in range(years[0], years[-1] + 1):
+        year_aggregates = aggregates.get(str(year), {})
+        for month_number, month in enumerate(MONTH_NAMES, start=1):
+            summary = year_aggregates.get(month, {}).get(habit)
+            if summary is None:
+                summaries.append(StreakSummary.gap(calendar.monthrange(year, month_number)[1]))
+            else:
+                summaries.append(StreakSummary(summary["days"], summary["lead"], summary["trail"], summary["best"]))
+    return years[0], summaries
+
+
+def streak_tree(aggregates: dict, habit: str) -> tuple[int, StreakTree]:
+    """Segment tree over the month_streaks of a habit, for streaks of any range of months.
+
+    Usage:
+        first_year, tree = streak_tree(aggregates, "Read")
+        tree.query(12 * (2023 - first_year), 12 * (2025 - first_year)).best  # over 2023 and 2024
+
+    """
+    first_year, summaries = month_streaks(aggregates, habit)
+    return first_year, StreakTree(summaries)
+
+
+def year_streak(aggregates: dict, year: str, habit: str) -> int:
+    """Longest streak of the habit within the year, joined across months (a missing month breaks it)."""
+    _, summaries = month_streaks({year: aggregates.get(year, {})}, habit)
+    return sum(summaries, StreakSummary()).best
+
+
+def lifetime_streak(aggregates: dict, habit: str) -> int:
+    """Longest streak of the habit over the whole history, joined across months and years."""
+    _, summaries = month_streaks(aggregates, habit)
+    return sum(summaries, StreakSummary()).best
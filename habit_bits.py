@@ -0,0 +1,151 @@
+"""Habit statistics on packed habit-month bitmasks.
+
+A habit-month packs into one 32-bit integer with day 1 in the lowest bit (the storage format of
+firebase_utils.encode_user_data). On uint32 arrays of such masks (any shape, e.g. users x
+months x habits) the statistics are a few whole-array bit operations instead of walks over
+day lists:
+
+- days performed is a popcount (np.bitwise_count);
+- the longest run is the number of ``x &= x >> 1`` steps until x is 0 (each step shortens every
+  run by one day);
+- the runs touching the first and last day of a month come from ``x & ~(x + 1)`` and the
+  highest missed day, which joins months into streaks across month boundaries.
+
+Results are the same as utils.count_total_days, utils.get_longest_streak and the monthly totals
+of the Yearly Insights page (see benchmarks/habit_bits.py).
+
+Example:
+    >>> masks = pack(np.array([[1, 1, 0, 1, 1, 1, 0], [0, 0, 0, 0, 0, 0, 0]]))
+    >>> popcount(masks), longest_run(masks)
+    (array([5, 0], dtype=uint8), array([3, 0], dtype=uint8))
+
+"""
+import calendar
+
+import numpy as np
+
+MAX_DAYS = 32
+
+
+def pack(days: np.ndarray) -> np.ndarray:
+    """Pack 0/1 day vectors (last axis, up to 32 days) into uint32 masks, day 1 in the lowest bit."""
+    days = np.asarray(days)
+    if days.shape[-1] > MAX_DAYS:
+        raise ValueError(f"A mask holds at most {MAX_DAYS} days, got {days.shape[-1]}.")
+    shifts = np.arange(days.shape[-1], dtype=np.uint32)
+    return np.bitwise_or.reduce((days != 0).astype(np.uint32) << shifts, axis=-1)
+
+
+def unpack(masks: np.ndarray, num_days: int = MAX_DAYS) -> np.ndarray:
+    """Unpack uint32 masks into uint8 day vectors of num_days days (new last axis)."""
+    shifts = np.arange(num_days, dtype=np.uint32)
+    return ((np.asarray(masks, dtype=np.uint32)[..., None] >> shifts) & 1).astype(np.uint8)
+
+
+def full_mask(num_days: np.ndarray | int) -> np.ndarray:
+    """Mask with all num_days days set."""
+    return ((np.uint64(1) << np.asarray(num_days, dtype=np.uint64)) - np.uint64(1)).astype(np.uint32)
+
+
+def days_in_months(first_year: int, num_months: int) -> np.ndarray:
+    """Number of days of num_months consecutive months starting with January of first_year."""
+    return np.array([calendar.monthrange(first_year + i // 12, i % 12 + 1)[1] for i in range(num_months)])
+
+
+def popcount(masks: np.ndarray) -> np.ndarray:
+    """Number of days performed in every mask."""
+    return np.bitwise_count(np.asarray(masks, dtype=np.uint32))
+
+
+def longest_run(masks: np.ndarray) -> np.ndarray:
+    """Longest run of consecutive days in every mask."""
+    masks = np.array(masks, dtype=np.uint32)
+    length = np.zeros(masks.shape, dtype=np.uint8)
+    while True:
+        remaining = masks != 0
+        if not remaining.any():
+            return length
+        length += remaining
+        masks &= masks >> np.uint32(1)
+
+
+def leading_run(masks: np.ndarray) -> np.ndarray:
+    """Run of consecutive days starting on day 1 (the trailing one bits)."""
+    masks = np.asarray(masks, dtype=np.uint32)
+    return np.bitwise_count(masks & ~(masks + np.uint32(1)))  # x + 1 wraps to 0 for a full mask
+
+
+def trailing_run(masks: np.ndarray, num_days: np.ndarray | int) -> np.ndarray:
+    """Run of consecutive days ending on the last day of the month (num_days, broadcast with masks)."""
+    masks = np.asarray(masks, dtype=np.uint32)
+    num_days = np.asarray(num_days)
+    missed = ~masks & full_mask(num_days)
+    # frexp gives the exact position of the highest set bit: 2**(exponent - 1) <= missed
+    last_missed = np.frexp(missed.astype(np.float64))[1] - 1
+    return np.where(missed == 0, num_days, num_days - 1 - last_missed).astype(np.uint8)
+
+
+def longest_streak(masks: np.ndarray, num_days: np.ndarray) -> np.ndarray:
+    """Longest streak over consecutive months (last axis), joining runs across month boundaries.
+
+    Args:
+        masks (np.ndarray): uint32 masks of consecutive months in the last axis, a month
+        without data is 0 (and breaks the streak).
+        num_days (np.ndarray): Number of days of each month (length of the last axis).
+
+    Returns:
+        np.ndarray: The longest streak of every series (the shape of masks without the last axis).
+
+    """
+    masks = np.asarray(masks, dtype=np.uint32)
+    num_days = np.asarray(num_days)
+    lead = leading_run(masks).astype(np.int64)
+    trail = trailing_run(masks, num_days).astype(np.int64)
+    full = masks == full_mask(num_days)
+
+    best = longest_run(masks).max(axis=-1, initial=0).astype(np.int64)
+    run = np.zeros(masks.shape[:-1], dtype=np.int64)  # run ending on the last day of the previous month
+    for month in range(masks.shape[-1]):
+        best = np.maximum(best, run + lead[..., month])  # no out=, best is a scalar for 1-D masks
+        run = np.where(full[..., month], run + num_days[month], trail[..., month])
+    return best
+
+
+def weekday_masks(first_year: int, num_months: int) -> np.ndarray:
+    """(months x 7) masks of the days of each month falling on Monday, Tuesday, ..., Sunday."""
+    masks = np.zeros((num_months, 7), dtype=np.uint32)
+    for i in range(num_months):
+        year, month = first_year + i // 12, i % 12 + 1
+        first_weekday, num_days = calendar.monthrange(year, month)
+        for day in range(num_days):
+            masks[i, (first_weekday + day) % 7] |= np.uint32(1 << day)
+    return masks
+
+
+def weekday_totals(masks: np.ndarray, first_year: int) -> np.ndarray:
+    """Days performed per weekday (Monday first) over consecutive months starting with January of first_year.
+
+    Args:
+        masks (np.ndarray): uint32 masks of consecutive months in the last axis.
+        first_year (int): Year of the first month.
+
+    Returns:
+        np.ndarray: The totals, with the month axis replaced by a weekday axis of length 7.
+
+    """
+    masks = np.asarray(masks, dtype=np.uint32)
+    per_month = np.bitwise_count(masks[..., None] & weekday_masks(first_year, masks.shape[-1]))
+    return per_month.sum(axis=-2, dtype=np.int64)
+
+
+def window_counts(masks: np.ndarray, window: int, num_days: int = MAX_DAYS) -> np.ndarray:
+    """Days performed in every window of consecutive days within a month.
+
+    Returns an array with a new last axis of num_days - window + 1 windows, the first
+    starting on day 1.
+
+    """
+    masks = np.asarray(masks, dtype=np.uint32)
+    starts = np.arange(num_days - window + 1, dtype=np.uint32)
+    windows = full_mask(window) << starts
+    return np.bitwise_count(masks[..., None] & windows)
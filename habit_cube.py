@@ -0,0 +1,144 @@
+"""Columnar view of a user's habit history.
+
+Firestore stores a user as nested maps, {year: {month name: {habit: [0/1 per day]}}}. A
+HabitCube converts that document once into a days x habits uint8 array over real calendar
+dates (one row per day from January 1st of the first year to December 31st of the last),
+a habit name index and a months x habits mask of which habit-months were recorded, so the
+monthly statistics become array slices.
+
+Example:
+    >>> cube = build_cube({"2024": {"January": {"Workout": [1, 1, 0]}, "February": {"Read": [0, 1]}}})
+    >>> cube.years(), cube.months(2024), cube.habits_in(2024)
+    ([2024], [1, 2], ['Read', 'Workout'])
+    >>> cube.month_days(2024, 1, "Workout")[:3]
+    array([1, 1, 0], dtype=uint8)
+
+"""
+import calendar
+import datetime
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+import numpy as np
+
+MONTH_NAMES = list(calendar.month_name)[1:]
+_MONTH_NUMBERS = {name: number for number, name in enumerate(MONTH_NAMES, start=1)}
+
+
+@dataclass(frozen=True)
+class HabitCube:
+    """A user's habit history as arrays indexed by calendar day and habit.
+
+    Attributes:
+        first_year (int): Year of the first row of days.
+        habits (tuple[str, ...]): Habit names, in column order (sorted).
+        days (np.ndarray): (days x habits) uint8 array, 1 where the habit was performed.
+        Days of months that were not recorded are 0.
+        recorded (np.ndarray): (months x habits) bool array, True where the habit has data
+        for the month. Row 0 is January of first_year.
+
+    """
+    first_year: int
+    habits: tuple[str, ...]
+    days: np.ndarray
+    recorded: np.ndarray
+    habit_index: dict[str, int] = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "habit_index", {name: i for i, name in enumerate(self.habits)})
+
+    @property
+    def start(self) -> datetime.date:
+        """Date of the first row of days."""
+        return datetime.date(self.first_year, 1, 1)
+
+    def day_index(self, date: datetime.date) -> int:
+        """Row of days holding the given date."""
+        return date.toordinal() - self.start.toordinal()
+
+    def month_span(self, year: int, month: int) -> slice:
+        """Rows of days of a month (1 = January)."""
+        first = self.day_index(datetime.date(year, month, 1))
+        return slice(first, first + calendar.monthrange(year, month)[1])
+
+    def _month_row(self, year: int, month: int) -> int:
+        return (year - self.first_year) * 12 + month - 1
+
+    def years(self) -> list[int]:
+        """Years with at least one recorded month."""
+        per_year = self.recorded.any(axis=1).reshape(-1, 12).any(axis=1)
+        return [self.first_year + int(i) for i in np.flatnonzero(per_year)]
+
+    def months(self, year: int) -> list[int]:
+        """Recorded months (1 = January) of a year, in calendar order."""
+        if year not in self.years():
+            return []
+        row = self._month_row(year, 1)
+        return [int(month) + 1 for month in np.flatnonzero(self.recorded[row:row + 12].any(axis=1))]
+
+    def habits_in(self, year: int, month: int | None = None) -> list[str]:
+        """Habits recorded in a month, or in any month of the year, sorted by name."""
+        if year not in self.years():
+            return []
+        row = self._month_row(year, month or 1)
+        mask = self.recorded[row] if month else self.recorded[row:row + 12].any(axis=0)
+        return [self.habits[i] for i in np.flatnonzero(mask)]
+
+    def month_days(self, year: int, month: int, habit: str) -> np.ndarray:
+        """Day vector of a habit in a month."""
+        return self.days[self.month_span(year, month), self.habit_index[habit]]
+
+
+def build_cube(user_data: dict) -> HabitCube:
+    """Convert a user document ({year: {month name: {habit: [0/1 per day]}}}) into a HabitCube.
+
+    Keys that are not years or month names (e.g. reserved fields) are ignored, and day lists
+    longer than their month are cut at the month's last day.
+
+    """
+    months = [
+        (int(year), _MONTH_NUMBERS[month_name], habit_days)
+        for year, year_data in (user_data or {}).items() if str(year).isdigit() and isinstance(year_data, dict)
+        for month_name, habit_days in year_data.items() if month_name in _MONTH_NUMBERS
+    ]
+    if not months:
+        today = datetime.date.today()
+        return HabitCube(today.year, (), np.zeros((0, 0), dtype=np.uint8), np.zeros((12, 0), dtype=bool))
+
+    first_year = min(year for year, _, _ in months)
+    last_year = max(year for year, _, _ in months)
+    habits = tuple(sorted({habit for _, _, habit_days in months for habit in habit_days}))
+    num_days = datetime.date(last_year + 1, 1, 1).toordinal() - datetime.date(first_year, 1, 1).toordinal()
+
+    cube = HabitCube(
+        first_year,
+        habits,
+        np.zeros((num_days, len(habits)), dtype=np.uint8),
+        np.zeros(((last_year - first_year + 1) * 12, len(habits)), dtype=bool),
+    )
+    for year, month, habit_days in months:
+        span = cube.month_span(year, month)
+        for habit, values in habit_days.items():
+            column = cube.habit_index[habit]
+            values = np.asarray(values, dtype=np.uint8)[:span.stop - span.start]
+            cube.days[span.start:span.start + len(values), column] = values
+            cube.recorded[cube._month_row(year, month), column] = True
+    return cube
+
+
+def session_cube(user_email: str, revision: object, load_user_data: Callable[[], dict | None]) -> HabitCube:
+    """The HabitCube of a user, built once per Streamlit session.
+
+    load_user_data is only called when the cube has to be (re)built: on the first run and
+    whenever the user or the revision (e.g. the document's update_time) changes, so a save
+    from another page is picked up on the next run.
+
+    """
+    import streamlit as st  # imported lazily so the cube stays usable without Streamlit
+
+    key = (user_email, revision)
+    cached = st.session_state.get("habit_cube")
+    if cached is None or cached[0] != key:
+        cached = (key, build_cube(load_user_data()))
+        st.session_state["habit_cube"] = cached
+    return cached[1]
@@ -0,0 +1,39 @@
+"""Move users from the nested layout (every year a field of users/{email}) to the years layout
+(every year a document users/{email}/years/{year}), building their manifest and aggregates.
+
+Every user is migrated in one transaction and migrated users are skipped, so the script can be
+interrupted and run again until it reports no more users to migrate.
+
+Run from the repository root, with firebase.json there:
+    python helpful-scripts/14_migrate_to_year_documents.py                 # all users
+    python helpful-scripts/14_migrate_to_year_documents.py a@b.com c@d.com # some users
+"""
+import os
+import sys
+
+import firebase_admin
+from firebase_admin import credentials, firestore
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import firebase_utils as fb_utils  # noqa: E402
+
+# Initialize Firebase Admin SDK
+if not firebase_admin._apps:
+    cred = credentials.Certificate("firebase.json")
+    firebase_admin.initialize_app(cred)
+
+db = firestore.client()
+
+user_emails = sys.argv[1:] or [user_ref.id for user_ref in db.collection("users").list_documents()]
+
+migrated, failed = 0, 0
+for user_email in user_emails:
+    try:
+        if fb_utils.migrate_to_year_documents(db, user_email):
+            migrated += 1
+            print(f"Migrated {user_email}.")
+    except Exception as e:
+        failed += 1
+        print(f"An error occurred while migrating {user_email}: {e}")
+
+print(f"{migrated} users migrated, {len(user_emails) - migrated - failed} already migrated, {failed} failed.")
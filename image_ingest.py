@@ -0,0 +1,212 @@
+"""Decode uploaded template photos without extra copies and at the resolution the detector needs.
+
+The image header is parsed first (JPEG SOF and EXIF orientation, PNG IHDR) so the decode can
+be planned before any pixel is touched:
+
+- JPEGs larger than the pixel budget are decoded with libjpeg's DCT scaling
+  (IMREAD_REDUCED_COLOR_2/4/8), which is much faster than a full decode and never
+  allocates the full resolution image.
+- The EXIF orientation is applied explicitly, so sideways phone photos come out upright
+  whatever the decode mode.
+- Images that would still exceed max_pixels after the reduction are rejected before decoding.
+
+Example:
+    >>> import image_ingest
+    >>> with open("assets/test_img.jpeg", "rb") as f:
+    ...     decoded = image_ingest.decode_image(f.read())
+    >>> decoded.image.shape, decoded.reduction
+    ((3314, 2441, 3), 1)
+
+"""
+import struct
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+# Decoded pixels the detector needs: larger JPEGs are decoded at 1/2, 1/4 or 1/8 scale as
+# long as the result keeps at least this many pixels. Below ~12 MP the reduced decodes start
+# to change which checkboxes are detected on the reference photos.
+DEFAULT_PIXEL_BUDGET = 12_000_000
+
+# Largest image (in decoded pixels) we accept
+MAX_PIXELS = 50_000_000
+
+_REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+# JPEG start-of-frame markers (all except DHT 0xC4, JPG 0xC8 and DAC 0xCC)
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_EXIF_ORIENTATION_TAG = 0x0112
+
+
+class ImageTooLargeError(ValueError):
+    """Raised when an image has more pixels than the ingest accepts."""
+
+
+@dataclass(frozen=True)
+class ImageInfo:
+    """What the header of an encoded image says about it.
+
+    Attributes:
+        format (str): "jpeg", "png" or "unknown".
+        width (int | None): Stored width in pixels (before the orientation is applied).
+        height (int | None): Stored height in pixels.
+        orientation (int): EXIF orientation (1 to 8, 1 = upright).
+
+    """
+    format: str
+    width: int | None = None
+    height: int | None = None
+    orientation: int = 1
+
+
+@dataclass
+class DecodedImage:
+    """An upright BGR image and how it was decoded.
+
+    Attributes:
+        image (np.ndarray): The decoded image (BGR), with the EXIF orientation applied.
+        info (ImageInfo): Header information of the encoded image.
+        reduction (int): Downscale factor of the decode (1, 2, 4 or 8).
+
+    """
+    image: np.ndarray
+    info: ImageInfo
+    reduction: int = 1
+
+
+def _exif_orientation(exif: memoryview) -> int:
+    """Read the orientation tag from the IFD0 of an EXIF (TIFF) block, 1 if absent or malformed."""
+    try:
+        byte_order = {b"II": "<", b"MM": ">"}[bytes(exif[:2])]
+        (ifd_offset,) = struct.unpack_from(byte_order + "I", exif, 4)
+        (entries,) = struct.unpack_from(byte_order + "H", exif, ifd_offset)
+        for i in range(entries):
+            tag, _, _, value = struct.unpack_from(byte_order + "HHIH", exif, ifd_offset + 2 + 12 * i)
+            if tag == _EXIF_ORIENTATION_TAG:
+                return value if 1 <= value <= 8 else 1
+    except (KeyError, struct.error):
+        pass
+    return 1
+
+
+def _probe_jpeg(data: memoryview) -> ImageInfo:
+    width = height = None
+    orientation = 1
+    i, size = 2, len(data)
+    while i + 4 <= size:
+        if data[i] != 0xFF:
+            break
+        marker = data[i + 1]
+        if marker == 0xFF:            # fill byte
+            i += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        if marker in (0xD9, 0xDA):    # end of image / start of scan: no more headers
+            break
+        (length,) = struct.unpack_from(">H", data, i + 2)
+        segment = data[i + 4:i + 2 + length]
+        if marker == 0xE1 and bytes(segment[:6]) == b"Exif\x00\x00":
+            orientation = _exif_orientation(segment[6:])
+        elif marker in _SOF_MARKERS and len(segment) >= 5:
+            height, width = struct.unpack_from(">HH", segment, 1)
+            break                     # the EXIF block always precedes the frame header
+        i += 2 + length
+    return ImageInfo("jpeg", width, height, orientation)
+
+
+def probe_image(data: bytes | memoryview) -> ImageInfo:
+    """Parse the dimensions and EXIF orientation from the header of an encoded image.
+
+    Only the header bytes are read, nothing is decoded.
+
+    """
+    data = memoryview(data)
+    if bytes(data[:3]) == b"\xff\xd8\xff":
+        return _probe_jpeg(data)
+    if bytes(data[:8]) == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+        width, height = struct.unpack_from(">II", data, 16)
+        return ImageInfo("png", width, height)
+    return ImageInfo("unknown")
+
+
+def apply_orientation(image: np.ndarray, orientation: int) -> np.ndarray:
+    """Turn an image decoded as stored into its upright view, following the EXIF orientation."""
+    if orientation == 2:
+        return cv2.flip(image, 1)
+    if orientation == 3:
+        return cv2.rotate(image, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(image, 0)
+    if orientation == 5:
+        return cv2.transpose(image)
+    if orientation == 6:
+        return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.flip(cv2.transpose(image), -1)
+    if orientation == 8:
+        return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return image
+
+
+def choose_reduction(info: ImageInfo, pixel_budget: int | None = DEFAULT_PIXEL_BUDGET) -> int:
+    """Pick the largest JPEG decode reduction (1, 2, 4 or 8) that keeps at least pixel_budget pixels."""
+    if pixel_budget is None or info.format != "jpeg" or not info.width or not info.height:
+        return 1
+    for factor in (8, 4, 2):
+        if -(-info.width // factor) * -(-info.height // factor) >= pixel_budget:
+            return factor
+    return 1
+
+
+def decode_reduction(data: bytes | memoryview, pixel_budget: int | None = DEFAULT_PIXEL_BUDGET) -> int:
+    """The reduction decode_image will decode the data with (read from the header only)."""
+    return choose_reduction(probe_image(data), pixel_budget)
+
+
+def decode_image(data: bytes | memoryview,
+                 pixel_budget: int | None = DEFAULT_PIXEL_BUDGET,
+                 max_pixels: int = MAX_PIXELS) -> DecodedImage:
+    """Decode an encoded image (JPEG or PNG) into an upright BGR image.
+
+    The encoded bytes are wrapped, not copied.
+
+    Args:
+        data (bytes | memoryview): The encoded image, e.g. UploadedFile.getbuffer().
+        pixel_budget (int | None, optional): Minimum number of pixels the detector needs.
+        Larger JPEGs are decoded at a reduced scale. None always decodes at full resolution.
+        Defaults to DEFAULT_PIXEL_BUDGET.
+        max_pixels (int, optional): Largest accepted number of decoded pixels. Defaults to MAX_PIXELS.
+
+    Returns:
+        DecodedImage: The image, its header information and the decode reduction.
+
+    Raises:
+        ImageTooLargeError: If the decoded image would have more than max_pixels pixels.
+        ValueError: If the data cannot be decoded as an image.
+
+    """
+    info = probe_image(data)
+    reduction = choose_reduction(info, pixel_budget)
+    if info.width and info.height:
+        decoded_pixels = -(-info.width // reduction) * -(-info.height // reduction)
+        if decoded_pixels > max_pixels:
+            raise ImageTooLargeError(f"The image is too large ({info.width}x{info.height} pixels), "
+                                     f"the maximum is {max_pixels / 1e6:.0f} megapixels.")
+
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    img = cv2.imdecode(buffer, _REDUCED_FLAGS[reduction] | cv2.IMREAD_IGNORE_ORIENTATION)
+    if img is None:
+        raise ValueError("The uploaded file could not be decoded as an image.")
+    if img.shape[0] * img.shape[1] > max_pixels:
+        raise ImageTooLargeError(f"The image is too large, the maximum is {max_pixels / 1e6:.0f} megapixels.")
+
+    return DecodedImage(apply_orientation(img, info.orientation), info, reduction)
+
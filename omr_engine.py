@@ -0,0 +1,468 @@
+"""Headless extraction engine for the Consistify habit tracking template.
+
+This module only depends on OpenCV and NumPy, so it can be imported from the Streamlit
+pages, from command line scripts and from worker processes without pulling in Streamlit
+or Firebase.
+
+Example:
+    >>> import omr_engine
+    >>> img = omr_engine.read_image("assets/example.png")
+    >>> result = omr_engine.extract_habit_data(img, 2024)
+    >>> result.month_name, result.binary_array.shape
+    ('December', (31, 6))
+
+"""
+from dataclasses import dataclass, field
+
+import cv2
+import numpy as np
+
+import utils
+from profiling import StageProfile, StageProfiler
+from template_layout import DEFAULT_LAYOUT, TemplateLayout
+
+THRESHOLD_ADJUSTMENT = 0          # ± value to adjust the threshold
+DETECTION_MARGIN = 6              # downscaled pixels around a coarse rectangle searched again at full resolution
+
+# Bump whenever a change can alter the extracted data, it invalidates stored results (see result_cache)
+ALGORITHM_VERSION = "2"
+
+
+class TemplateDetectionError(ValueError):
+    """Raised when the three template rectangles cannot be found in the image."""
+
+
+@dataclass
+class ExtractionResult:
+    """The data extracted from one photo of a filled template.
+
+    Attributes:
+        binary_array (np.ndarray): (days_in_month x habits) array, 1 where a checkbox is marked.
+        month (int): Detected month number (1 for January, 12 for December).
+        month_name (str): Detected month name (e.g. "January").
+        confidences (np.ndarray): Same shape as binary_array. Distance of each cell's fill from
+            the decision threshold, relative to the fullest cell (0 = on the threshold, 1 = certain).
+        month_confidence (float): Margin between the most and second most filled month cell,
+            relative to the most filled one.
+        overlay (np.ndarray | None): The input image (BGR) annotated with the detected checkboxes,
+            month and stats. None when extracted with extract_only.
+        timings (dict[str, float]): Wall time in seconds spent in each pipeline stage
+            ("detect", "warp", "measure", "threshold" and, unless extract_only, "overlay").
+        profile (dict[str, StageProfile]): Wall time, CPU time, peak allocation and image
+            dimensions of each stage. Empty unless the extraction was profiled.
+
+    """
+    binary_array: np.ndarray
+    month: int
+    month_name: str
+    confidences: np.ndarray
+    month_confidence: float
+    overlay: np.ndarray | None = None
+    timings: dict[str, float] = field(default_factory=dict)
+    profile: dict[str, StageProfile] = field(default_factory=dict)
+
+
+def read_image(path: str) -> np.ndarray:
+    """Read an image from disk in OpenCV format (BGR).
+
+    Raises:
+        ValueError: If the file does not exist or cannot be decoded as an image.
+
+    """
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError(f"Could not read image '{path}'.")
+    return img
+
+
+def _warp_image(img: np.ndarray,
+                src_points: np.ndarray,
+                dst_points: np.ndarray,
+                size: tuple[int, int]) -> tuple[np.ndarray, np.ndarray]:
+    """Warp the quadrilateral src_points of the image onto the (width, height) rectangle dst_points."""
+    matrix = cv2.getPerspectiveTransform(src_points, dst_points)
+    return cv2.warpPerspective(img, matrix, size), matrix
+
+
+def _threshold_image(img_gray: np.ndarray) -> np.ndarray:
+    """Apply Otsu's thresholding to a grayscale image."""
+    _, img_thresh = cv2.threshold(img_gray, 0, 255,
+                                  cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return img_thresh
+
+
+def _edge_map(img_gray: np.ndarray, downscaled: bool = False) -> np.ndarray:
+    """The edge map the rectangle search runs on.
+
+    A downscaled image is already smoothed by the area interpolation and gets a lighter
+    blur (with the full one, the borders of neighbouring boxes merge on some photos).
+
+    """
+    imgBlur = cv2.GaussianBlur(img_gray, (3, 3), 0) if downscaled else cv2.GaussianBlur(img_gray, (5, 5), 1)
+    return cv2.Canny(imgBlur, 10, 50)
+
+
+def _detect_rect_corners(img_gray: np.ndarray, downscaled: bool = False) -> list[np.ndarray] | None:
+    """Run the edge and contour search on a grayscale image.
+
+    Returns the approximated corner points of the three biggest rectangles, or None if
+    fewer than three valid rectangles are found.
+
+    """
+    # Find and process contours
+    contours, _ = cv2.findContours(_edge_map(img_gray, downscaled), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+
+    # Detect the three biggest rectangles, the corners come straight from the candidate search
+    candidates = utils.top_rect_candidates(contours, 3)
+    if len(candidates) < 3:
+        return None
+    return [candidate.corners for candidate in candidates]
+
+
+def _redetect_rect(img_gray: np.ndarray, coarse: np.ndarray, margin: int) -> np.ndarray | None:
+    """Find a rectangle again at full resolution, near the outline of its coarse corners.
+
+    The edge map is only computed on strips of margin pixels around the four coarse edges
+    (with some context for the blur), so the contour search sees the rectangle's border
+    but not what is inside it. Returns the corner points in image coordinates, or None if
+    no rectangle with corners within margin pixels of the coarse ones is found.
+
+    """
+    height, width = img_gray.shape
+    points = coarse.reshape(4, 2)
+    x0, y0 = np.maximum(np.floor(points.min(axis=0)).astype(int) - margin, 0)
+    x1, y1 = np.minimum(np.ceil(points.max(axis=0)).astype(int) + margin + 1, (width, height))
+    edges = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+
+    context = 8  # pixels of context for the blur and gradient at the strip boundaries
+    for start, end in zip(points, np.roll(points, -1, axis=0)):
+        sx0, sy0 = np.maximum(np.floor(np.minimum(start, end)).astype(int) - margin, (x0, y0))
+        sx1, sy1 = np.minimum(np.ceil(np.maximum(start, end)).astype(int) + margin + 1, (x1, y1))
+        cx0, cy0 = max(sx0 - context, 0), max(sy0 - context, 0)
+        cx1, cy1 = min(sx1 + context, width), min(sy1 + context, height)
+        strip = _edge_map(img_gray[cy0:cy1, cx0:cx1])[sy0 - cy0:sy1 - cy0, sx0 - cx0:sx1 - cx0]
+        np.bitwise_or(edges[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0], strip,
+                      out=edges[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0])
+
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE, offset=(int(x0), int(y0)))
+    candidates = utils.top_rect_candidates(contours, 1)
+    if not candidates:
+        return None
+    corners = candidates[0].corners
+    # Same corners in any order, each near one coarse corner
+    distances = np.linalg.norm(corners.reshape(4, 1, 2) - points.reshape(1, 4, 2), axis=-1)
+    if not (distances.min(axis=1) <= margin).all():
+        return None
+    return corners
+
+
+def find_template_rectangles(img: np.ndarray,
+                             detection_max_side: int | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Find the checkbox grid, stats box and month selector rectangles of the template.
+
+    When detection_max_side is given and the image is larger, the edge and contour search
+    runs on a copy downscaled so that its longest side is detection_max_side pixels. Each
+    rectangle found there is then searched again at full resolution, on the edges within
+    DETECTION_MARGIN downscaled pixels of its outline only, which gives the corners of the
+    full resolution search. If either pass misses a rectangle, the whole image is searched
+    at full resolution.
+
+    Args:
+        img (np.ndarray): Input image in OpenCV format (BGR).
+        detection_max_side (int | None, optional): Longest side of the working resolution
+        for the rectangle search. Defaults to None (full resolution).
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: The reordered corner points (float32, shape
+        (4, 1, 2)) of the biggest, second biggest and third biggest rectangle.
+
+    Raises:
+        TemplateDetectionError: If fewer than three rectangles are found.
+
+    """
+    imgGray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+    corners = None
+    height, width = imgGray.shape
+    if detection_max_side and max(height, width) > detection_max_side:
+        scale = detection_max_side / max(height, width)
+        small_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        small_corners = _detect_rect_corners(cv2.resize(imgGray, small_size, interpolation=cv2.INTER_AREA),
+                                             downscaled=True)
+        if small_corners is not None:
+            # Map back to full resolution (per axis, the rounding makes the factors differ slightly)
+            factors = np.float32([width / small_size[0], height / small_size[1]])
+            margin = DETECTION_MARGIN * int(np.ceil(max(factors)))
+            corners = [_redetect_rect(imgGray, (rect.astype(np.float32) + 0.5) * factors - 0.5, margin)
+                       for rect in small_corners]
+            if any(rect is None for rect in corners):
+                corners = None
+
+    if corners is None:
+        corners = _detect_rect_corners(imgGray)
+        if corners is None:
+            raise TemplateDetectionError("One or more required rectangles could not be detected.")
+
+    # Ensure proper formatting of rectangle points
+    biggest, second_biggest, third_biggest = (np.array(utils.reorder(rect), dtype=np.float32) for rect in corners)
+    return biggest, second_biggest, third_biggest
+
+
+@dataclass
+class TemplateMeasurement:
+    """Everything about a photo that does not depend on the year or the checkbox threshold.
+
+    Computing it is the expensive part of the pipeline (edge detection, contours, warps and
+    Otsu thresholding), so it can be cached per image and reused while the threshold changes.
+
+    Attributes:
+        image_shape (tuple[int, ...]): Shape of the measured image.
+        grid_matrix (np.ndarray): Perspective transform from the image to the checkbox grid.
+        stats_matrix (np.ndarray): Perspective transform from the image to the stats box.
+        month_matrix (np.ndarray): Perspective transform from the image to the month selector.
+        layout (TemplateLayout): The template layout the image was measured with.
+        cell_fill (np.ndarray): (checkbox_rows x checkbox_cols) non-zero pixel count of each checkbox.
+        month (int): Detected month number.
+        month_name (str): Detected month name.
+        month_confidence (float): See ExtractionResult.month_confidence.
+        timings (dict[str, float]): Wall time of the "detect", "warp" and "measure" stages.
+        profile (dict[str, StageProfile]): Detailed profile of the same stages, if profiled.
+
+    """
+    image_shape: tuple[int, ...]
+    grid_matrix: np.ndarray
+    stats_matrix: np.ndarray
+    month_matrix: np.ndarray
+    layout: TemplateLayout
+    cell_fill: np.ndarray
+    month: int
+    month_name: str
+    month_confidence: float
+    timings: dict[str, float] = field(default_factory=dict)
+    profile: dict[str, StageProfile] = field(default_factory=dict)
+
+
+def measure_template(img: np.ndarray,
+                     detection_max_side: int | None = None,
+                     layout: TemplateLayout = DEFAULT_LAYOUT,
+                     profiler: StageProfiler | None = None) -> TemplateMeasurement:
+    """Locate the template in the image and measure the fill of every checkbox and month cell.
+
+    Args:
+        img (np.ndarray): Input image in OpenCV format (BGR).
+        detection_max_side (int | None, optional): Search the template rectangles on a copy
+        downscaled to this longest side (see find_template_rectangles). Defaults to None.
+        layout (TemplateLayout, optional): Geometry of the template. Defaults to the v1 template.
+        profiler (StageProfiler | None, optional): Profiler to record the stages with, e.g. one
+        that already timed the decode. Defaults to a new disabled profiler (wall times only).
+
+    Returns:
+        TemplateMeasurement: The perspective transforms, cell fills and detected month.
+
+    Raises:
+        ValueError: If img is not a decoded image.
+        TemplateDetectionError: If the template rectangles cannot be detected.
+
+    """
+    if img is None or img.ndim != 3:
+        raise ValueError("Expected a decoded BGR image.")
+
+    profiler = profiler or StageProfiler()
+    biggest_rectCon, second_biggest_rectCon, third_biggest_rectCon = find_template_rectangles(img, detection_max_side)
+    profiler.lap("detect", img.shape)
+
+    # Warp main regions
+    imgWarpColored, matrix = _warp_image(img, biggest_rectCon, layout.grid_dst_points, layout.grid_size)
+    matrixS = cv2.getPerspectiveTransform(second_biggest_rectCon, layout.stats_dst_points)  # only needed for the overlay
+    imgWarpColoredT, matrixT = _warp_image(img, third_biggest_rectCon, layout.month_dst_points, layout.month_size)
+    profiler.lap("warp", img.shape)
+
+    ##################### Month Area Processing #####################
+    # Process month selector
+    imgThreshT = _threshold_image(cv2.cvtColor(imgWarpColoredT, cv2.COLOR_BGR2GRAY))
+    monthPixelVal = utils.grid_occupancy(imgThreshT, layout.month_rows, layout.month_cols,
+                                         layout.month_col_starts)[layout.month_header_rows:]
+    month, month_name = utils.detect_month(monthPixelVal)
+
+    month_fill = np.sort(monthPixelVal, axis=None)
+    month_confidence = float((month_fill[-1] - month_fill[-2]) / month_fill[-1]) if month_fill[-1] else 0.0
+
+    ##################### Checkbox Area Processing #####################
+    imgThresh = _threshold_image(cv2.cvtColor(imgWarpColored, cv2.COLOR_BGR2GRAY))
+    myPixelVal = utils.grid_occupancy(imgThresh, layout.checkbox_rows, layout.checkbox_cols,
+                                      layout.grid_col_starts)
+    profiler.lap("measure", imgWarpColored.shape)
+
+    return TemplateMeasurement(
+        image_shape=img.shape,
+        grid_matrix=matrix,
+        stats_matrix=matrixS,
+        month_matrix=matrixT,
+        layout=layout,
+        cell_fill=myPixelVal,
+        month=int(month),
+        month_name=month_name,
+        month_confidence=month_confidence,
+        timings=dict(profiler.timings),
+        profile=dict(profiler.profile),
+    )
+
+
+def binarize(measurement: TemplateMeasurement,
+             year: int,
+             percentage_threshold: int = 50) -> tuple[np.ndarray, np.ndarray, int]:
+    """Decide which checkboxes are marked.
+
+    Args:
+        measurement (TemplateMeasurement): Result of measure_template.
+        year (int): The year of the template being processed.
+        percentage_threshold (int, optional): Threshold for checkbox detection. Defaults to 50.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, int]: The full (checkbox_rows x checkbox_cols) binary array
+        with the rows after the last day of the month set to zero, the per-cell confidences and
+        the number of days in the detected month.
+
+    """
+    myPixelVal = measurement.cell_fill
+    max_fill = np.max(myPixelVal)
+    threshold = max_fill * (percentage_threshold / 100) + THRESHOLD_ADJUSTMENT
+    binary_array = (myPixelVal > threshold).astype(int)
+    confidences = np.clip(np.abs(myPixelVal - threshold) / max_fill, 0, 1) if max_fill else np.zeros(myPixelVal.shape)
+
+    no_of_days = utils.get_days_in_month(year, measurement.month_name)
+
+    # replace the rows after the number of days with zeros (required to draw circles)
+    binary_array[no_of_days:, :] = 0
+    return binary_array, confidences, no_of_days
+
+
+def render_overlay(img: np.ndarray,
+                   measurement: TemplateMeasurement,
+                   binary_array: np.ndarray,
+                   no_of_days: int) -> np.ndarray:
+    """Draw the detected month, checkboxes and stats onto a copy of the image.
+
+    The circle and month marker positions come precomputed from the measurement's template
+    layout, the stats are laid out by utils.apply_stats_to_image.
+
+    Args:
+        img (np.ndarray): The image that was measured, in OpenCV format (BGR).
+        measurement (TemplateMeasurement): Result of measure_template for img.
+        binary_array (np.ndarray): Full binary array returned by binarize.
+        no_of_days (int): Number of days in the detected month.
+
+    Returns:
+        np.ndarray: The annotated image.
+
+    """
+    layout = measurement.layout
+    imgFinal = img.copy()
+
+    # Highlight detected month
+    month_width, month_height = layout.month_size
+    imgRawMonth = np.zeros((month_height, month_width, 3), img.dtype)
+    center_x, center_y = layout.month_marker_centers[measurement.month - 1]
+    cv2.circle(imgRawMonth, (int(center_x), int(center_y)), layout.month_marker_radius, (33, 33, 33), 5)
+    utils.overlay_warped_image(imgFinal, imgRawMonth, measurement.month_matrix)
+
+    # Overlay detected checkboxes on the original image
+    grid_width, grid_height = layout.grid_size
+    imgRawCircles = np.zeros((grid_height, grid_width, 3), img.dtype)
+    for center_x, center_y in layout.circle_centers[binary_array == 1]:
+        cv2.circle(imgRawCircles, (int(center_x), int(center_y)), layout.circle_radius, (0, 0, 255), -1)
+    utils.overlay_warped_image(imgFinal, imgRawCircles, measurement.grid_matrix)
+
+    # Calculate and display stats
+    days = binary_array[:no_of_days, :]
+    total_days = utils.count_total_days(days)
+    longest_streak = utils.get_longest_streak(days)
+
+    imgRawStats = np.zeros((layout.stats_height, layout.stats_width, 3), img.dtype)
+    imgRawStats = utils.apply_stats_to_image(imgRawStats, total_days, f"/{no_of_days}", 0.15)
+    imgRawStats = utils.apply_stats_to_image(imgRawStats, longest_streak, "day streak", -0.2)
+    utils.overlay_warped_image(imgFinal, imgRawStats, measurement.stats_matrix)
+
+    return imgFinal
+
+
+def extract_from_measurement(img: np.ndarray,
+                             measurement: TemplateMeasurement,
+                             year: int,
+                             percentage_threshold: int = 50,
+                             extract_only: bool = False,
+                             profiler: StageProfiler | None = None) -> ExtractionResult:
+    """Run the threshold dependent stages (binarization and overlay) on a cached measurement.
+
+    Args:
+        img (np.ndarray): The image that was measured, in OpenCV format (BGR).
+        measurement (TemplateMeasurement): Result of measure_template for img.
+        year (int): The year of the template being processed.
+        percentage_threshold (int, optional): Threshold for checkbox detection. Defaults to 50.
+        extract_only (bool, optional): Skip the overlay, result.overlay is None. Defaults to False.
+        profiler (StageProfiler | None, optional): Profiler to record the stages with.
+        Defaults to a new disabled profiler (wall times only).
+
+    Returns:
+        ExtractionResult: See extract_habit_data.
+
+    """
+    profiler = profiler or StageProfiler()
+    binary_array, confidences, no_of_days = binarize(measurement, year, percentage_threshold)
+    profiler.lap("threshold", measurement.cell_fill.shape)
+
+    overlay = None
+    if not extract_only:
+        overlay = render_overlay(img, measurement, binary_array, no_of_days)
+        profiler.lap("overlay", img.shape)
+
+    return ExtractionResult(
+        binary_array=binary_array[:no_of_days, :],
+        month=measurement.month,
+        month_name=measurement.month_name,
+        confidences=confidences[:no_of_days, :],
+        month_confidence=measurement.month_confidence,
+        overlay=overlay,
+        timings={**measurement.timings, **profiler.timings},
+        profile={**measurement.profile, **profiler.profile},
+    )
+
+
+def extract_habit_data(img: np.ndarray,
+                       year: int,
+                       percentage_threshold: int = 50,
+                       detection_max_side: int | None = None,
+                       extract_only: bool = False,
+                       layout: TemplateLayout = DEFAULT_LAYOUT,
+                       profile: bool = False) -> ExtractionResult:
+    """Process the input image to extract habit tracking data.
+
+    This runs measure_template followed by extract_from_measurement. With extract_only the
+    pipeline stops after binarization and month detection and draws nothing, which is what
+    batch jobs that only need the data should use.
+
+    Args:
+        img (np.ndarray): Input image in OpenCV format (BGR).
+        year (int): The year of the template being processed.
+        percentage_threshold (int, optional): Threshold for checkbox detection.
+        Defaults to 50.
+        detection_max_side (int | None, optional): Search the template rectangles on a copy
+        downscaled to this longest side (see find_template_rectangles). Defaults to None.
+        extract_only (bool, optional): Skip all visualization work, result.overlay is None.
+        Defaults to False.
+        layout (TemplateLayout, optional): Geometry of the template. Defaults to the v1 template.
+        profile (bool, optional): Record CPU time, peak allocation and image dimensions of
+        every stage in result.profile (see profiling.StageProfiler). Defaults to False.
+
+    Returns:
+        ExtractionResult: The binary array of checkbox values, the detected month,
+        the detection confidences and the annotated image.
+
+    Raises:
+        ValueError: If img is not a decoded image.
+        TemplateDetectionError: If the template rectangles cannot be detected.
+
+    """
+    with StageProfiler(profile) as profiler:
+        measurement = measure_template(img, detection_max_side, layout, profiler)
+        return extract_from_measurement(img, measurement, year, percentage_threshold, extract_only, profiler)
@@ -8,6 +8,8 @@ from PIL import Image, ImageDraw, ImageFont
 
 import auth_functions
 import firebase_utils as fbutils
+import habit_aggregates
+import habit_cube
 import utils
 
 st.set_page_config(page_title="Monthly Insights", page_icon="📅")
@@ -93,28 +95,6 @@ def draw_circles_on_image(image: np.ndarray, circle_array: list[int]) -> np.ndar
     # Return the image with the circles drawn
     return image
 
-def longest_streak(arr: list[int]) -> int:
-    """Finds the longest streak of consecutive 1's in a binary array.
-
-    Args:
-    arr (list): A binary list containing only 0s and 1s.
-
-    Returns:
-    int: The length of the longest streak of 1's.
-
-    """
-    max_streak = 0
-    current_streak = 0
-
-    for num in arr:
-        if num == 1:
-            current_streak += 1
-            max_streak = max(max_streak, current_streak)
-        else:
-            current_streak = 0
-
-    return max_streak
-
 def fill_month_template(month: int, 
                         year: int, 
                         habit_name: str, 
@@ -142,7 +122,7 @@ def fill_month_template(month: int,
     days_habit_performed = sum(habit_array)
 
     # Calculate the longest streak of the habit in the month
-    habit_streak = longest_streak(habit_array)
+    habit_streak = utils.streak_stats(habit_array).longest
 
     success_rate = int(days_habit_performed / days_in_month * 100)
 
@@ -192,15 +172,20 @@ def fill_month_template(month: int,
 
     return image
 
-def get_habit_data_and_cumulative_sum(data: dict, year: str, month: str, habit: str) -> tuple[list[int], int]:
+def get_habit_data_and_cumulative_sum(cube: habit_cube.HabitCube,
+                                      aggregates: dict,
+                                      year: int,
+                                      month: str,
+                                      habit: str) -> tuple[list[int], int]:
     """Retrieves the binary array for a specific habit in a given year and month,
     along with the cumulative number of days the habit was performed from January
     to the specified month.
 
     Parameters
     ----------
-    - data (dict): The dictionary containing habit data.
-    - year (str): The year as a string (e.g., '2024').
+    - cube (habit_cube.HabitCube): The user's habit history.
+    - aggregates (dict): The user's habit-month aggregates (see habit_aggregates).
+    - year (int): The year (e.g., 2024).
     - month (str): The month as a string (e.g., 'March').
     - habit (str): The habit as a string (e.g., 'Workout').
 
@@ -213,33 +198,22 @@ def get_habit_data_and_cumulative_sum(data: dict, year: str, month: str, habit:
 
     """
     try:
-        # List of months in order to calculate cumulative sum
-        months_in_order = ["January", "February", "March", "April", "May", "June",
-                           "July", "August", "September", "October", "November", "December"]
+        if month not in habit_cube.MONTH_NAMES:
+            raise ValueError(f"Invalid month '{month}'.")
+        month_number = habit_cube.MONTH_NAMES.index(month) + 1
 
-        if year not in data:
+        if year not in cube.years():
             raise KeyError(f"Year '{year}' not found in the data.")
 
-        if month not in months_in_order:
-            raise ValueError(f"Invalid month '{month}'.")
-
-        if month not in data[year]:
+        if month_number not in cube.months(year):
             raise KeyError(f"Month '{month}' not found in the data for year '{year}'.")
 
-        if habit not in data[year][month]:
+        if habit not in cube.habits_in(year, month_number):
             raise KeyError(f"Habit '{habit}' not found in the data for year '{year}', month '{month}'.")
 
-        # Binary array for the specified month
-        binary_array = data[year][month][habit]
-
-        # Cumulative sum calculation
-        cumulative_sum = 0
-        for m in months_in_order:
-            if m in data[year]:
-                if habit in data[year][m]:
-                    cumulative_sum += sum(data[year][m][habit])
-            if m == month:
-                break
+        # Binary array for the specified month, the sum from January 1st to its last day is precomputed
+        binary_array = cube.month_days(year, month_number, habit).tolist()
+        cumulative_sum = habit_aggregates.year_to_date(aggregates.get(str(year), {}), month, habit)
 
         return binary_array, cumulative_sum
 
@@ -275,34 +249,22 @@ def monthly_insights_main() -> None:
         auth_functions.sign_out()
         st.rerun()
 
-    # Fetch user data dynamically
-    def get_user_data(user_email):
-        doc = db.collection("users").document(user_email).get()
-        if doc.exists:
-            return doc.to_dict()
-        return None
-
-    # Helper to sort months in chronological order
-    def sort_months_chronologically(months):
-        month_order = list(calendar.month_name)[1:]  # Skip the empty string at index 0
-        return sorted(months, key=lambda x: month_order.index(x))
-
     user_email = st.session_state["user_info"]["email"]
 
-    # Fetch user data from Firebase
-    user_data = get_user_data(user_email)
+    # Fetch the years, months and habits of the user (not their data) for the dropdowns
+    manifest = fbutils.load_manifest(db, user_email)
+    available_years = sorted(year for year, months in manifest.items() if months)
 
-    if user_data:
-        # Extract available years and allow selection
-        available_years = sorted(user_data.keys())
+    if available_years:
+        # Allow selection of a year
         selected_year = st.selectbox("Select Year", available_years)
 
-        # Extract available months for the selected year
-        available_months = sort_months_chronologically(list(user_data[selected_year].keys()))
+        # Extract available months for the selected year, in chronological order
+        available_months = sorted(manifest[selected_year], key=lambda x: list(calendar.month_name).index(x))
         selected_month = st.selectbox("Select Month", available_months)
 
         # Extract habits for the selected year and month
-        available_habits = sorted(user_data[selected_year][selected_month].keys())
+        available_habits = manifest[selected_year][selected_month]
         selected_habit = st.selectbox("Select Habit", available_habits)
 
         # Generate visualization button
@@ -311,9 +273,16 @@ def monthly_insights_main() -> None:
                 # Convert month name to month number
                 month_number = list(calendar.month_name).index(selected_month)
 
+                # Fetch only the selected year and convert it once per change
+                user_year = fbutils.load_year(db, user_email, selected_year)
+                cube = habit_cube.session_cube(
+                    user_email, (selected_year, user_year.update_time), lambda: {selected_year: user_year.data},
+                )
+
                 # Fetch habit data and calculate cumulative sum
+                aggregates = {selected_year: user_year.aggregates}
                 habit_array, total_days = get_habit_data_and_cumulative_sum(
-                    user_data, selected_year, selected_month, selected_habit,
+                    cube, aggregates, int(selected_year), selected_month, selected_habit,
                 )
 
                 # Create the filled month template
@@ -8,6 +8,7 @@ from PIL import Image, ImageDraw, ImageFont
 
 import auth_functions
 import firebase_utils as fb_utils
+import habit_aggregates
 import utils
 
 st.set_page_config(page_title="Yearly Insights", page_icon="📈")
@@ -227,102 +228,51 @@ def fill_year_template(year: int, habit_name: str, days_array: list[int], habit_
 
     return image
 
-def habit_days_count_year(data: dict, year: str, habit_name: str) -> list[int]:
+def habit_days_count_year(aggregates: dict, year: int, habit_name: str) -> list[int]:
     """Calculate the number of days a specific habit was performed in each month for a given year.
 
     Args:
-        data (dict): A dictionary containing habit data organized by year, month, and habit name.
-        year (str): The year for which to calculate the habit days.
+        aggregates (dict): The user's habit-month aggregates (see habit_aggregates).
+        year (int): The year for which to calculate the habit days.
         habit_name (str): The name of the habit to analyze.
 
     Returns:
-        list: A list of integers where each element corresponds to the number of days
-              the habit was performed in the respective month. The length of the list 
-              is based on the availability of data in the dictionary, with missing 
-              months treated as 0.
+        list: A list of 12 integers where each element corresponds to the number of days
+              the habit was performed in the respective month, with missing months
+              treated as 0.
     
     Example:
         Input:
-            year = "2023"
+            year = 2023
             habit_name = "Workout"
         Output:
             [23, 25, 18, 14, 25, ...]
 
     """
-    # Define the months in order
-    months_order = [
-        "January", "February", "March", "April",
-        "May", "June", "July", "August",
-        "September", "October", "November", "December",
-    ]
+    return habit_aggregates.monthly_totals(aggregates.get(str(year), {}), habit_name)
 
-    # Get the data for the given year
-    year_data = data.get(year, {})
-
-    # Initialize the result array with 0 for each month
-    result = [0] * 12
-
-    for month_index, month in enumerate(months_order):
-        # Check if the month exists in the data
-        if month in year_data and habit_name in year_data[month]:
-            # Count the number of days the habit was performed
-            result[month_index] = sum(year_data[month][habit_name])
-
-    # Remove trailing zeros to match the length of available data
-    # while result and result[-1] == 0:
-    #     result.pop()
-
-    return result
-
-def longest_habit_streak_across_year(data: dict, year: str, habit_name: str) -> int:
+def longest_habit_streak_across_year(aggregates: dict, year: int, habit_name: str) -> int:
     """Calculate the longest streak of consecutive days a specific habit was performed
     across all months in a given year.
 
     Args:
-        data (dict): A dictionary containing habit data organized by year, month, and habit name.
-        year (str): The year for which to calculate the longest streak.
+        aggregates (dict): The user's habit-month aggregates (see habit_aggregates).
+        year (int): The year for which to calculate the longest streak.
         habit_name (str): The name of the habit to analyze.
 
     Returns:
         int: The length of the longest streak of consecutive days the habit was performed 
-             across all months in the specified year.
+             across all months in the specified year (a missing month resets it).
     
     Example:
         Input:
-            year = "2023"
+            year = 2023
             habit_name = "Workout"
         Output:
             56  
 
     """
-    # Get the data for the given year
-    year_data = data.get(year, {})
-
-    longest_streak = 0
-    current_streak = 0
-
-    # Define the months in order
-    months_order = [
-        "January", "February", "March", "April",
-        "May", "June", "July", "August",
-        "September", "October", "November", "December",
-    ]
-
-    for month in months_order:
-        # Check if the month exists in the data and contains the habit
-        if month in year_data and habit_name in year_data[month]:
-            habit_days = year_data[month][habit_name]
-            for day in habit_days:
-                if day == 1:
-                    current_streak += 1
-                    longest_streak = max(longest_streak, current_streak)
-                else:
-                    current_streak = 0
-        else:
-            # Reset the streak if the month or habit data is missing
-            current_streak = 0
-
-    return longest_streak
+    return habit_aggregates.year_streak(aggregates, str(year), habit_name)
 
 def yearly_insights_main()-> None:
 
@@ -347,34 +297,25 @@ def yearly_insights_main()-> None:
 
     user_email = st.session_state["user_info"]["email"]
 
-    # Fetch user data dynamically
-    def get_user_data(user_email):
-        doc = db.collection("users").document(user_email).get()
-        if doc.exists:
-            return doc.to_dict()
-        return None
+    # Fetch the years, months and habits of the user (not their data) for the dropdowns
+    manifest = fb_utils.load_manifest(db, user_email)
+    available_years = sorted(year for year, months in manifest.items() if months)
 
-    # Fetch user data from Firebase
-    user_data = get_user_data(user_email)
-
-    if user_data:
-        # Extract available years and allow selection
-        available_years = sorted(user_data.keys())
+    if available_years:
+        # Allow selection of a year
         selected_year = st.selectbox("Select Year", available_years)
 
         # Extract habits dynamically for the selected year
-        habits_in_year = set()
-        for month_data in user_data[selected_year].values():
-            habits_in_year.update(month_data.keys())
-        habits_in_year = sorted(habits_in_year)
+        habits_in_year = sorted(set().union(*manifest[selected_year].values()))
         selected_habit = st.selectbox("Select Habit", habits_in_year)
 
         # Generate visualization button
         if st.button("Generate Year Visualization"):
             try:
-                # Calculate habit days count and longest streak
-                days_array = habit_days_count_year(user_data, selected_year, selected_habit)
-                habit_streak = longest_habit_streak_across_year(user_data, selected_year, selected_habit)
+                # Calculate habit days count and longest streak from the precomputed aggregates
+                aggregates = fb_utils.load_aggregates(db, user_email)
+                days_array = habit_days_count_year(aggregates, selected_year, selected_habit)
+                habit_streak = longest_habit_streak_across_year(aggregates, selected_year, selected_habit)
 
                 # Generate the year visualization
                 output_image = fill_year_template(
@@ -391,6 +332,10 @@ def yearly_insights_main()-> None:
                 # Display the generated image
                 st.image(img_rgb, caption=f"{selected_habit} - {selected_year}")
 
+                # Streaks carry over month and year boundaries, so the best one may span several years
+                lifetime_streak = habit_aggregates.lifetime_streak(aggregates, selected_habit)
+                st.write(f"**Longest streak ever:** {lifetime_streak} days")
+
                 # Convert the PIL image (img_pil) to bytes for download
                 img_bytes = io.BytesIO()
                 img_pil.save(img_bytes, format="PNG")  # Use the PIL image here
@@ -22,9 +22,10 @@ def clear_data_main()->None:
 
     user_email = st.session_state["user_info"].get("email")
 
-    user_data = fb_utils.get_all_user_data(db, user_email)
+    # Only the years and months are needed, not the habit data
+    manifest = fb_utils.load_manifest(db, user_email)
 
-    if user_data:
+    if any(manifest.values()):
         st.write("You can delete all your data or data for a specific year or month.")
 
         clear_data_options = ["All Data", "Data for a Specific Year", "Data for a Specific Month"]
@@ -41,7 +42,7 @@ def clear_data_main()->None:
 
         elif clear_data_choice == "Data for a Specific Year":
             # Dropdown to select year
-            available_years = sorted(user_data.keys())
+            available_years = sorted(year for year, months in manifest.items() if months)
             selected_year = st.selectbox("Select Year to Delete", available_years)
 
             if st.button(f"Delete Data for {selected_year}"):
@@ -53,11 +54,11 @@ def clear_data_main()->None:
 
         elif clear_data_choice == "Data for a Specific Month":
             # Dropdowns to select year and month
-            available_years = sorted(user_data.keys())
+            available_years = sorted(year for year, months in manifest.items() if months)
             selected_year = st.selectbox("Select Year", available_years)
 
             if selected_year:
-                available_months = sorted(user_data[selected_year].keys(), key=lambda x: list(calendar.month_name).index(x))
+                available_months = sorted(manifest[selected_year], key=lambda x: list(calendar.month_name).index(x))
                 selected_month = st.selectbox("Select Month to Delete", available_months)
 
                 if st.button(f"Delete Data for {selected_month} {selected_year}"):
@@ -0,0 +1,133 @@
+"""Per-stage instrumentation of the extraction pipeline.
+
+A StageProfiler measures consecutive stages: every call to lap(stage) closes the stage that
+started at the previous lap. Wall times are always recorded (they are a single clock read).
+When the profiler is enabled it additionally records the CPU time, the peak memory allocated
+during the stage (via tracemalloc) and the dimensions of the image the stage worked on, and
+writes one log line per stage.
+
+tracemalloc is global to the process, so the memory peaks are only meaningful when one
+profiler runs at a time (the benchmarks and the batch workers). Multi-threaded callers, such
+as the Streamlit page whose sessions are threads of one process, pass trace_memory=False.
+
+Example:
+    >>> import cv2
+    >>> with StageProfiler(enabled=True) as profiler:
+    ...     img = cv2.imread("assets/example.png")
+    ...     profiler.lap("decode", img.shape)
+    >>> profiler.profile["decode"].image_shape
+    (842, 674, 3)
+
+"""
+import logging
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class StageProfile:
+    """Resources used by one pipeline stage.
+
+    Attributes:
+        wall (float): Wall time in seconds.
+        cpu (float): CPU time of the process in seconds (all threads).
+        peak_bytes (int | None): Peak memory allocated during the stage, above what was allocated
+        when it started (None if memory was not traced).
+        image_shape (tuple[int, ...] | None): Shape of the image the stage worked on.
+
+    """
+    wall: float
+    cpu: float
+    peak_bytes: int | None
+    image_shape: tuple[int, ...] | None = None
+
+
+class StageProfiler:
+    """Records the wall time between consecutive calls to lap(), and more when enabled.
+
+    Use it as a context manager when enabled: tracemalloc is started on entry (unless it is
+    already tracing) and stopped again on exit. With trace_memory=False tracemalloc is left
+    alone and no peaks are recorded.
+
+    """
+
+    def __init__(self, enabled: bool = False, trace_memory: bool = True) -> None:
+        self.enabled = enabled
+        self.trace_memory = trace_memory
+        self.timings: dict[str, float] = {}
+        self.profile: dict[str, StageProfile] = {}
+        self._owns_tracemalloc = False
+        self._allocated = 0
+        self._cpu = time.process_time()
+        self._last = time.perf_counter()
+
+    def __enter__(self) -> "StageProfiler":
+        if self.enabled and self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._owns_tracemalloc = True
+            self._reset_baseline()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+            self._owns_tracemalloc = False
+
+    def _reset_baseline(self) -> None:
+        tracemalloc.reset_peak()
+        self._allocated = tracemalloc.get_traced_memory()[0]
+        self._cpu = time.process_time()
+        self._last = time.perf_counter()
+
+    def lap(self, stage: str, image_shape: tuple[int, ...] | None = None) -> None:
+        """Close the current stage under the given name and start the next one."""
+        now = time.perf_counter()
+        self.timings[stage] = now - self._last
+        if not self.enabled:
+            self._last = now
+            return
+
+        cpu = time.process_time() - self._cpu
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        peak_bytes = max(0, tracemalloc.get_traced_memory()[1] - self._allocated) if tracing else None
+        stats = StageProfile(self.timings[stage], cpu, peak_bytes, image_shape)
+        self.profile[stage] = stats
+        logger.info("stage=%s wall_ms=%.1f cpu_ms=%.1f peak_kib=%s shape=%s",
+                    stage, stats.wall * 1e3, stats.cpu * 1e3,
+                    "-" if peak_bytes is None else f"{peak_bytes / 1024:.0f}", image_shape)
+
+        # Keep the bookkeeping above out of the next stage
+        if tracing:
+            self._reset_baseline()
+        else:
+            self._cpu = time.process_time()
+            self._last = time.perf_counter()
+
+
+def profile_rows(profile: dict[str, StageProfile]) -> list[dict]:
+    """Flatten a stage profile into table rows (one per stage, in pipeline order) for display."""
+    return [
+        {
+            "stage": stage,
+            "wall (ms)": round(stats.wall * 1e3, 2),
+            "cpu (ms)": round(stats.cpu * 1e3, 2),
+            "peak (KiB)": "" if stats.peak_bytes is None else round(stats.peak_bytes / 1024, 1),
+            "image": "x".join(map(str, stats.image_shape)) if stats.image_shape else "",
+        }
+        for stage, stats in profile.items()
+    ]
+
+
+def log_to_stderr(level: int = logging.INFO) -> None:
+    """Send the stage log lines to stderr (idempotent)."""
+    if not any(getattr(handler, "_profiling", False) for handler in logger.handlers):
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+        handler._profiling = True
+        logger.addHandler(handler)
+    logger.setLevel(level)
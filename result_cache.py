@@ -0,0 +1,203 @@
+"""Persistent, content-addressed cache of extraction results.
+
+Results are stored in a local SQLite database, keyed by the SHA-256 of the encoded image,
+the year, the checkbox threshold and omr_engine.ALGORITHM_VERSION, so re-uploading the same
+photo skips all OpenCV work. Each entry holds the binary array, the month, the confidences
+and (optionally) the overlay encoded as JPEG. When the stored entries exceed the size cap,
+the least recently used ones are evicted.
+
+The database location and size cap default to ~/.cache/consistify/results.sqlite and 256 MB,
+and can be changed with the CONSISTIFY_CACHE_PATH and CONSISTIFY_CACHE_MAX_MB environment
+variables.
+
+Usage:
+    cache = ResultCache()
+    result = cache.get(image_digest, year, percentage_threshold)
+    if result is None:
+        result = omr_engine.extract_habit_data(img, year, percentage_threshold)
+        cache.put(image_digest, year, percentage_threshold, result)
+
+"""
+import hashlib
+import io
+import os
+import sqlite3
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+import omr_engine
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "consistify", "results.sqlite")
+DEFAULT_MAX_MB = 256
+OVERLAY_JPEG_QUALITY = 90
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    month INTEGER NOT NULL,
+    month_name TEXT NOT NULL,
+    month_confidence REAL NOT NULL,
+    binary_array BLOB NOT NULL,
+    confidences BLOB NOT NULL,
+    overlay BLOB,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access);
+"""
+
+
+def variant(reduction: int = 1, detection_max_side: int | None = None) -> str:
+    """Cache key variant of results decoded with a JPEG reduction and detected at detection_max_side.
+
+    Full resolution decode and detection give "", so every writer that decodes and detects
+    the same way shares the results, whatever its ingest settings are.
+
+    """
+    parts = []
+    if reduction != 1:
+        parts.append(f"reduction={reduction}")
+    if detection_max_side:
+        parts.append(f"detection_max_side={detection_max_side}")
+    return ",".join(parts)
+
+
+def _pack_array(array: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def _unpack_array(blob: bytes) -> np.ndarray:
+    return np.load(io.BytesIO(blob), allow_pickle=False)
+
+
+class ResultCache:
+    """SQLite store of ExtractionResults with least-recently-used eviction.
+
+    Every operation opens its own short-lived connection, so one instance can be shared
+    between Streamlit sessions (threads) and several processes can use the same file.
+
+    Args:
+        path (str | None, optional): Database file. Defaults to CONSISTIFY_CACHE_PATH or DEFAULT_PATH.
+        max_bytes (int | None, optional): Size cap of the stored entries. Defaults to
+        CONSISTIFY_CACHE_MAX_MB (or DEFAULT_MAX_MB) megabytes.
+
+    """
+
+    def __init__(self, path: str | None = None, max_bytes: int | None = None) -> None:
+        self.path = path or os.environ.get("CONSISTIFY_CACHE_PATH", DEFAULT_PATH)
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get("CONSISTIFY_CACHE_MAX_MB", DEFAULT_MAX_MB)) * 1024 * 1024)
+        self.max_bytes = max_bytes
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Open a connection for one transaction (committed on success, rolled back on error)."""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def key(image_digest: str, year: int, percentage_threshold: int, variant: str = "") -> str:
+        """Cache key of an image (SHA-256 hex digest of its bytes) and the extraction parameters.
+
+        variant distinguishes results of a reduced decode or non-default engine options (e.g.
+        a coarse detection resolution) that would otherwise share a key, see variant().
+
+        """
+        parts = (omr_engine.ALGORITHM_VERSION, image_digest, str(year), str(percentage_threshold), variant)
+        return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+    def get(self,
+            image_digest: str,
+            year: int,
+            percentage_threshold: int,
+            variant: str = "",
+            with_overlay: bool = True) -> omr_engine.ExtractionResult | None:
+        """Return the stored result, or None on a miss.
+
+        With with_overlay, an entry stored without an overlay (extract_only) counts as a miss.
+
+        """
+        key = self.key(image_digest, year, percentage_threshold, variant)
+        columns = "month, month_name, month_confidence, binary_array, confidences"
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {columns}, {'overlay' if with_overlay else 'NULL'} "
+                               "FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None or (with_overlay and row[5] is None):
+                return None
+            conn.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+
+        month, month_name, month_confidence, binary_blob, confidences_blob, overlay_blob = row
+        overlay = None
+        if overlay_blob is not None:
+            overlay = cv2.imdecode(np.frombuffer(overlay_blob, dtype=np.uint8), cv2.IMREAD_COLOR)
+        return omr_engine.ExtractionResult(
+            binary_array=_unpack_array(binary_blob),
+            month=month,
+            month_name=month_name,
+            confidences=_unpack_array(confidences_blob),
+            month_confidence=month_confidence,
+            overlay=overlay,
+        )
+
+    def put(self,
+            image_digest: str,
+            year: int,
+            percentage_threshold: int,
+            result: omr_engine.ExtractionResult,
+            variant: str = "") -> None:
+        """Store a result (replacing any previous entry) and evict old entries above the size cap."""
+        binary_blob = _pack_array(result.binary_array)
+        confidences_blob = _pack_array(result.confidences)
+        overlay_blob = None
+        if result.overlay is not None:
+            _, encoded = cv2.imencode(".jpg", result.overlay, [cv2.IMWRITE_JPEG_QUALITY, OVERLAY_JPEG_QUALITY])
+            overlay_blob = encoded.tobytes()
+        size = len(binary_blob) + len(confidences_blob) + len(overlay_blob or b"")
+
+        key = self.key(image_digest, year, percentage_threshold, variant)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, result.month, result.month_name, result.month_confidence,
+                 binary_blob, confidences_blob, overlay_blob, size, time.time()),
+            )
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """Delete the least recently used entries until the stored size fits the cap."""
+        excess = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0] - self.max_bytes
+        if excess <= 0:
+            return
+        freed, stale_keys = 0, []
+        for key, size in conn.execute("SELECT key, size FROM results ORDER BY last_access"):
+            stale_keys.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        conn.executemany("DELETE FROM results WHERE key = ?", stale_keys)
+
+    def stats(self) -> dict[str, int]:
+        """Number of entries and their total size in bytes."""
+        with self._connect() as conn:
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        return {"entries": entries, "bytes": size}
+
+    def clear(self) -> None:
+        """Delete all entries."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM results")
@@ -0,0 +1,108 @@
+"""Mergeable streak summaries of day ranges.
+
+A StreakSummary describes a range of days by its length, the run of performed days at its
+start (prefix) and at its end (suffix), and its longest run (best). The summary of two
+adjacent ranges is computed from their summaries alone, and the merge is associative,
+so the longest streak over any sequence of months or years is a fold over their summaries,
+and a StreakTree answers it for any range of segments in O(log n).
+
+Example:
+    >>> january = StreakSummary.from_days([0, 1, 1])
+    >>> february = StreakSummary.from_days([1, 1, 1, 0])
+    >>> january + february
+    StreakSummary(length=7, prefix=0, suffix=0, best=5)
+    >>> tree = StreakTree([january, StreakSummary.gap(5), february])
+    >>> tree.query(0, 3).best, tree.query(2, 3).best
+    (3, 3)
+
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+import utils
+
+
+@dataclass(frozen=True)
+class StreakSummary:
+    """Streak statistics of a range of days.
+
+    Attributes:
+        length (int): Number of days in the range.
+        prefix (int): Run of performed days starting on the first day.
+        suffix (int): Run of performed days ending on the last day.
+        best (int): Longest run of performed days.
+
+    The empty range (all zeros) is the identity of the merge.
+
+    """
+    length: int = 0
+    prefix: int = 0
+    suffix: int = 0
+    best: int = 0
+
+    @property
+    def all_ones(self) -> bool:
+        """Whether the habit was performed on every day of the range."""
+        return self.prefix == self.length
+
+    def __add__(self, other: "StreakSummary") -> "StreakSummary":
+        """Summary of this range followed directly by the other one."""
+        return StreakSummary(
+            length=self.length + other.length,
+            prefix=self.length + other.prefix if self.all_ones else self.prefix,
+            suffix=self.suffix + other.length if other.all_ones else other.suffix,
+            best=max(self.best, other.best, self.suffix + other.prefix),
+        )
+
+    @classmethod
+    def from_days(cls, days: list[int] | np.ndarray) -> "StreakSummary":
+        """Summary of a 0/1 day vector."""
+        days = np.asarray(days) != 0
+        stats = utils.streak_stats(days)
+        missed = np.flatnonzero(~days)
+        return cls(int(days.size), int(missed[0]) if missed.size else int(days.size), stats.current, stats.longest)
+
+    @classmethod
+    def gap(cls, num_days: int) -> "StreakSummary":
+        """Summary of num_days days without the habit (e.g. a month without data)."""
+        return cls(length=num_days)
+
+
+class StreakTree:
+    """Segment tree of StreakSummaries (e.g. one per month) for range queries and point updates.
+
+    Args:
+        summaries (list[StreakSummary]): The summaries of consecutive segments.
+
+    """
+
+    def __init__(self, summaries: list[StreakSummary]) -> None:
+        self.size = len(summaries)
+        self._nodes = [StreakSummary()] * self.size + list(summaries)
+        for node in range(self.size - 1, 0, -1):
+            self._nodes[node] = self._nodes[2 * node] + self._nodes[2 * node + 1]
+
+    def update(self, index: int, summary: StreakSummary) -> None:
+        """Replace the summary of one segment."""
+        node = index + self.size
+        self._nodes[node] = summary
+        while node > 1:
+            node //= 2
+            self._nodes[node] = self._nodes[2 * node] + self._nodes[2 * node + 1]
+
+    def query(self, start: int = 0, stop: int | None = None) -> StreakSummary:
+        """Summary of the segments start to stop (exclusive), i.e. all of them by default."""
+        stop = self.size if stop is None else stop
+        left, right = StreakSummary(), StreakSummary()
+        low, high = start + self.size, stop + self.size
+        while low < high:
+            if low & 1:
+                left = left + self._nodes[low]
+                low += 1
+            if high & 1:
+                high -= 1
+                right = self._nodes[high] + right
+            low //= 2
+            high //= 2
+        return left + right
@@ -0,0 +1,132 @@
+"""Declarative geometry of the printable habit tracking template.
+
+A TemplateLayout describes the three regions the extraction engine warps (checkbox grid,
+stats box and month selector) and precomputes, once per template version, everything the
+pipeline derives from that geometry: warp destination points, cell column boundaries,
+overlay circle centers and month marker positions.
+
+Example:
+    >>> layout = get_layout("v1")
+    >>> layout.grid_size, layout.circle_centers.shape
+    ((534, 558), (31, 6, 2))
+
+"""
+from dataclasses import dataclass, field
+
+import numpy as np
+
+import utils
+
+
+def _corner_points(width: int, height: int) -> np.ndarray:
+    """Destination points of a warp, in the [top-left, top-right, bottom-left, bottom-right] order of utils.reorder."""
+    return np.float32([[0, 0], [width, 0], [0, height], [width, height]])
+
+
+@dataclass(frozen=True)
+class TemplateLayout:
+    """Geometry of one template version, in the pixel units of the rectified regions.
+
+    Attributes:
+        version (str): Template version identifier.
+        checkbox_rows (int): Number of days (rows) in the checkbox grid.
+        checkbox_cols (int): Number of habits (columns) in the checkbox grid.
+        grid_width (int): Nominal width of the checkbox grid (rounded down to a multiple of checkbox_cols).
+        grid_height (int): Nominal height of the checkbox grid (rounded down to a multiple of checkbox_rows).
+        stats_width (int): Width of the stats box.
+        stats_height (int): Height of the stats box.
+        month_rows (int): Rows of the month selector, including the header rows.
+        month_cols (int): Columns of the month selector.
+        month_box_width (int): Width of one month selector cell.
+        month_box_height (int): Height of one month selector cell.
+        month_header_rows (int): Rows at the top of the month selector that hold no month.
+
+    The remaining attributes are derived from these in __post_init__.
+
+    """
+    version: str = "v1"
+    checkbox_rows: int = 31
+    checkbox_cols: int = 6
+    grid_width: int = 534
+    grid_height: int = 558
+    stats_width: int = 564
+    stats_height: int = 92
+    month_rows: int = 4
+    month_cols: int = 4
+    month_box_width: int = 60
+    month_box_height: int = 26
+    month_header_rows: int = 1
+
+    # Derived geometry
+    grid_size: tuple[int, int] = field(init=False)
+    stats_size: tuple[int, int] = field(init=False)
+    month_size: tuple[int, int] = field(init=False)
+    grid_dst_points: np.ndarray = field(init=False, repr=False)
+    stats_dst_points: np.ndarray = field(init=False, repr=False)
+    month_dst_points: np.ndarray = field(init=False, repr=False)
+    grid_col_starts: np.ndarray = field(init=False, repr=False)
+    month_col_starts: np.ndarray = field(init=False, repr=False)
+    circle_centers: np.ndarray = field(init=False, repr=False)
+    circle_radius: int = field(init=False)
+    month_marker_centers: np.ndarray = field(init=False, repr=False)
+    month_marker_radius: int = field(init=False)
+
+    def __post_init__(self) -> None:
+        derived = {}
+
+        # Warp sizes (width, height) and destination points of the three regions
+        box_width = self.grid_width // self.checkbox_cols
+        box_height = self.grid_height // self.checkbox_rows
+        grid_w, grid_h = self.checkbox_cols * box_width, self.checkbox_rows * box_height
+        month_w, month_h = self.month_cols * self.month_box_width, self.month_rows * self.month_box_height
+        derived["grid_size"] = (grid_w, grid_h)
+        derived["stats_size"] = (self.stats_width, self.stats_height)
+        derived["month_size"] = (month_w, month_h)
+        derived["grid_dst_points"] = _corner_points(grid_w, grid_h)
+        derived["stats_dst_points"] = _corner_points(self.stats_width, self.stats_height)
+        derived["month_dst_points"] = _corner_points(month_w, month_h)
+
+        # Cell boundaries used to count the filled pixels of each cell
+        derived["grid_col_starts"] = utils.grid_column_starts(grid_w, self.checkbox_cols)
+        derived["month_col_starts"] = utils.grid_column_starts(month_w, self.month_cols)
+
+        # Checkbox circles (same grid math as utils.draw_circles_on_image)
+        cell_width = grid_w // self.checkbox_cols
+        cell_height = grid_h // self.checkbox_rows
+        rows, cols = np.mgrid[0:self.checkbox_rows, 0:self.checkbox_cols]
+        derived["circle_centers"] = np.stack([cols * cell_width + cell_width // 2,
+                                              rows * cell_height + cell_height // 2], axis=-1)
+        derived["circle_radius"] = min(cell_width, cell_height) // 2
+
+        # Month marker (same grid math as utils.draw_month_on_image_with_top_row)
+        top_row_height = month_h // self.month_rows * self.month_header_rows
+        month_cell_height = (month_h - top_row_height) // (self.month_rows - self.month_header_rows)
+        month_cell_width = month_w // self.month_cols
+        months = np.arange(12)
+        derived["month_marker_centers"] = np.stack([
+            months % self.month_cols * month_cell_width + month_cell_width // 2,
+            top_row_height + months // self.month_cols * month_cell_height + month_cell_height // 2,
+        ], axis=-1)
+        derived["month_marker_radius"] = min(month_cell_width, month_cell_height) // 5
+
+        for name, value in derived.items():
+            object.__setattr__(self, name, value)
+
+
+LAYOUTS = {
+    "v1": TemplateLayout(),
+}
+
+DEFAULT_LAYOUT = LAYOUTS["v1"]
+
+
+def get_layout(version: str = "v1") -> TemplateLayout:
+    """Return the compiled layout of a template version.
+
+    Raises:
+        KeyError: If the version is unknown.
+
+    """
+    if version not in LAYOUTS:
+        raise KeyError(f"Unknown template version '{version}'.")
+    return LAYOUTS[version]
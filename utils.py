@@ -1,15 +1,22 @@
 import base64
 import calendar
+import heapq
+from typing import NamedTuple
 
 import cv2
 import numpy as np
-import streamlit as st
+
+class RectCandidate(NamedTuple):
+    """A quadrilateral contour together with the geometry computed while finding it."""
+    contour: np.ndarray
+    area: float
+    corners: np.ndarray  # approxPolyDP corner points, shape (4, 1, 2)
 
 def rectContour(contours: tuple[np.ndarray]) -> list[np.ndarray]:
     """It takes the contours as input and returns the rectangle contours
 
     """
-    rectCon = []                        
+    rectCon = []
     for i in contours:
         area = cv2.contourArea(i)
         # print(area)
@@ -17,9 +24,42 @@ def rectContour(contours: tuple[np.ndarray]) -> list[np.ndarray]:
             peri = cv2.arcLength(i, True) # Calculate the perimeter of the contour (True: closed contour)
             approx = cv2.approxPolyDP(i, 0.02 * peri, True) # Approximate the polygon (how many corner points it has) (contour, resolution, closed)
             if len(approx) == 4: # If the contour has 4 corners
-                rectCon.append(i)
-    rectCon = sorted(rectCon, key=cv2.contourArea,reverse=True) # Sort the contours by area in descending order
-    return rectCon
+                rectCon.append((area, i))
+    rectCon.sort(key=lambda item: item[0], reverse=True) # Sort the contours by area in descending order (area computed once)
+    return [i for _, i in rectCon]
+
+def top_rect_candidates(contours: tuple[np.ndarray], k: int = 3, min_area: float = 50) -> list[RectCandidate]:
+    """Returns the k biggest quadrilateral contours, biggest first, with their corner points.
+
+    Gives the same rectangles as ``rectContour(contours)[:k]`` with ``getCornerPoints`` applied,
+    but each contour's area is computed once and the polygon approximation only runs on
+    contours popped from an area max-heap until k quadrilaterals are found, instead of on
+    every contour.
+
+    Parameters
+    ----------
+    - contours: tuple of np.array (Contours as returned by cv2.findContours)
+    - k: int (Number of rectangles to return)
+    - min_area: float (Contours with a smaller or equal area are ignored)
+
+    Returns
+    -------
+    - list of RectCandidate: At most k candidates, sorted by area in descending order.
+
+    """
+    # The index breaks ties in input order, like the stable sort in rectContour
+    heap = [(-area, index) for index, area in enumerate(map(cv2.contourArea, contours)) if area > min_area]
+    heapq.heapify(heap)
+
+    candidates = []
+    while heap and len(candidates) < k:
+        neg_area, index = heapq.heappop(heap)
+        contour = contours[index]
+        peri = cv2.arcLength(contour, True)
+        approx = cv2.approxPolyDP(contour, 0.02 * peri, True)
+        if len(approx) == 4:
+            candidates.append(RectCandidate(contour, -neg_area, approx))
+    return candidates
 
 def getCornerPoints(cont: np.ndarray) -> np.ndarray:
     """This function takes the contour as input and returns the corner points of the contour
@@ -37,7 +77,7 @@ def reorder(myPoints: np.ndarray) -> np.ndarray:
     """
     myPoints = myPoints.reshape((4, 2)) # REMOVE EXTRA BRACKET
     #print(myPoints)
-    myPointsNew = np.zeros((4, 1, 2), np.int32) # NEW MATRIX WITH ARRANGED POINTS
+    myPointsNew = np.zeros((4, 1, 2), myPoints.dtype) # NEW MATRIX WITH ARRANGED POINTS (keeps sub-pixel corners)
     add = myPoints.sum(1)
     myPointsNew[0] = myPoints[np.argmin(add)]  #[0,0]    # origin point has the smallest sum
     myPointsNew[3] =myPoints[np.argmax(add)]   #[w,h]    # w+h gives the largest sum
@@ -68,6 +108,46 @@ def splitBoxes(img: np.ndarray, rows: int = 6, cols: int = 31)-> list[np.ndarray
 
     return boxes
 
+def grid_column_starts(width: int, cols: int) -> np.ndarray:
+    """Returns the start offset of each column when an image of the given width is split into cols columns.
+
+    The first ``width % cols`` columns get one extra pixel, exactly as in ``splitBoxes``.
+
+    """
+    col_width, extra_pixels = divmod(width, cols)
+    index = np.arange(cols)
+    return index * col_width + np.minimum(index, extra_pixels)
+
+def grid_occupancy(img: np.ndarray, rows: int = 6, cols: int = 31,
+                   col_starts: np.ndarray | None = None) -> np.ndarray:
+    """Counts the non-zero pixels of every grid cell of a binary image in one vectorized pass.
+
+    The cells are the same as the boxes returned by ``splitBoxes(img, rows, cols)``, so
+    ``grid_occupancy(img, rows, cols).ravel()`` equals ``[cv2.countNonZero(box) for box in splitBoxes(img, rows, cols)]``.
+
+    Parameters
+    ----------
+    - img: np.array (Single channel image, e.g. the thresholded warp of a grid)
+    - rows: int (Number of rows, must divide the image height)
+    - cols: int (Number of columns)
+    - col_starts: np.array (Optional precomputed result of ``grid_column_starts``)
+
+    Returns
+    -------
+    - np.array: (rows x cols) array with the number of non-zero pixels in each cell.
+
+    """
+    height, width = img.shape[:2]
+    if height % rows:
+        raise ValueError("array split does not result in an equal division")
+    if col_starts is None:
+        col_starts = grid_column_starts(width, cols)
+
+    # Sum the pixel rows of every grid row first, then add up the uneven column spans
+    filled = (img != 0).view(np.uint8)
+    row_sums = filled.reshape(rows, height // rows, width).sum(axis=1, dtype=np.int32)
+    return np.add.reduceat(row_sums, col_starts, axis=1)
+
 def draw_circles_on_image(image: np.ndarray, binary_array: np.ndarray) -> np.ndarray:
     """Draws circles on the provided image based on the binary_array where 1s indicate the positions of the circles.
 
@@ -166,6 +246,70 @@ def get_days_in_month(year: int, month_name: str) -> int:
     _, num_days = calendar.monthrange(year, month_number)
     return num_days
 
+class StreakStats(NamedTuple):
+    """Run-length statistics of every habit column, as returned by ``streak_stats``."""
+    longest: np.ndarray  # longest run of consecutive 1s
+    current: np.ndarray  # run of 1s ending on the last day
+    start: np.ndarray    # first day of the (first) longest run
+    end: np.ndarray      # day after its last day, so end - start == longest (0, 0 without any run)
+
+def streak_stats(days: np.ndarray | list) -> StreakStats:
+    """Longest streak, current streak and longest streak boundaries of every habit at once.
+
+    The runs of 1s are found by run-length encoding each column with ``np.diff`` and
+    ``np.flatnonzero``, without a Python loop over the days, so the day vector can be a month,
+    a year or a whole history.
+
+    Parameters
+    ----------
+    - days: np.array or list (1D day vector, or 2D array with one row per day and one column per habit;
+                              non-zero values count as performed)
+
+    Returns
+    -------
+    - StreakStats: Arrays with one element per column, or ints for a 1D day vector.
+
+    Example:
+    >>> streak_stats([1, 1, 0, 1, 1, 1, 0, 1])
+    StreakStats(longest=3, current=1, start=3, end=6)
+
+    """
+    days = np.asarray(days)
+    vector = days.ndim == 1
+    if vector:
+        days = days[:, None]
+    num_days, num_habits = days.shape
+
+    # Pad every column with a 0 on both sides so each run has a +1 (start) and a -1 (end) edge.
+    # Transposing first makes the flat indices run column by column, so starts and ends pair up.
+    padded = np.zeros((num_habits, num_days + 2), dtype=np.int8)
+    padded[:, 1:-1] = days.T != 0
+    edges = np.diff(padded, axis=1).ravel()
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)
+    habit = run_starts // (num_days + 1)
+    run_starts -= habit * (num_days + 1)
+    run_ends -= habit * (num_days + 1)
+    lengths = run_ends - run_starts
+
+    longest = np.zeros(num_habits, dtype=np.int64)
+    np.maximum.at(longest, habit, lengths)
+
+    current = np.zeros(num_habits, dtype=np.int64)
+    last = run_ends == num_days
+    current[habit[last]] = lengths[last]
+
+    # Runs are ordered by day within each habit, so the first index per habit is the earliest longest run
+    start = np.zeros(num_habits, dtype=np.int64)
+    is_longest = lengths == longest[habit]
+    habits_with_runs, first = np.unique(habit[is_longest], return_index=True)
+    start[habits_with_runs] = run_starts[is_longest][first]
+    end = start + longest
+
+    if vector:
+        return StreakStats(int(longest[0]), int(current[0]), int(start[0]), int(end[0]))
+    return StreakStats(longest, current, start, end)
+
 def get_longest_streak(habit_array: np.ndarray) -> np.ndarray:
     """Calculate the longest streak of consecutive days each habit was performed.
 
@@ -179,20 +323,28 @@ def get_longest_streak(habit_array: np.ndarray) -> np.ndarray:
     numpy.ndarray: An array where each element represents the longest streak of consecutive days the corresponding habit was performed.
 
     """
-    def calculate_streak(array_column):
-        max_streak = 0
-        current_streak = 0
-        for day in array_column:
-            if day == 1:
-                current_streak += 1
-                max_streak = max(max_streak, current_streak)
-            else:
-                current_streak = 0
-        return max_streak
+    return streak_stats(habit_array).longest
+
+def pack_days(days: np.ndarray | list) -> int:
+    """Pack a day vector of up to 32 days into an integer bitmask, day 1 in the lowest bit.
+
+    Parameters
+    ----------
+    - days: np.array or list (0/1 per day, non-zero values count as performed)
+
+    Returns
+    -------
+    - int: The bitmask, e.g. ``pack_days([1, 0, 1, 1]) == 0b1101``.
+
+    """
+    days = np.asarray(days).ravel() != 0
+    if days.size > 32:
+        raise ValueError(f"A bitmask holds at most 32 days, got {days.size}.")
+    return int(days @ (1 << np.arange(days.size, dtype=np.int64)))
 
-    # Process each column in the array
-    streaks = np.array([calculate_streak(habit_array[:, col]) for col in range(habit_array.shape[1])])
-    return streaks
+def unpack_days(mask: int, num_days: int) -> list[int]:
+    """Unpack an integer bitmask made by ``pack_days`` into a list of num_days 0/1 values."""
+    return [(mask >> day) & 1 for day in range(num_days)]
 
 def detect_month(array: np.ndarray) -> tuple[int, str]:
     """This function takes a 2D numpy array where each row represents values for
@@ -394,6 +546,54 @@ def mask_outside_rectangle(image: np.ndarray,
 
     return result
 
+def overlay_warped_image(image: np.ndarray,
+                         overlay: np.ndarray,
+                         matrix: np.ndarray) -> np.ndarray:
+    """Inverse-warps an overlay onto the image and copies its non-black pixels (in place).
+
+    The overlay is drawn in the rectified space of ``matrix`` (the perspective transform from
+    the image to the overlay, as returned by ``cv2.getPerspectiveTransform``). The result is
+    byte-identical to warping the overlay over the full frame, but only the rows down to the
+    bottom of the overlay's destination quad are warped, and the mask is built and applied
+    inside the quad's bounding box only.
+
+    Parameters
+    ----------
+    - image: np.array (BGR image to draw on, modified in place)
+    - overlay: np.array (BGR overlay, black pixels are transparent)
+    - matrix: np.array (3x3 perspective transform from image to overlay coordinates)
+
+    Returns
+    -------
+    - np.array: The image with the overlay applied.
+
+    """
+    img_height, img_width = image.shape[:2]
+    overlay_height, overlay_width = overlay.shape[:2]
+    image_to_overlay = np.linalg.inv(matrix)
+
+    # Destination quad of the overlay, grown by one source pixel for the bilinear interpolation
+    corners = np.float64([[-1, -1], [overlay_width + 1, -1],
+                          [-1, overlay_height + 1], [overlay_width + 1, overlay_height + 1]]).reshape(-1, 1, 2)
+    quad = cv2.perspectiveTransform(corners, image_to_overlay).reshape(-1, 2)
+
+    x0 = max(int(np.floor(quad[:, 0].min())) - 1, 0)
+    y0 = max(int(np.floor(quad[:, 1].min())) - 1, 0)
+    x1 = min(int(np.ceil(quad[:, 0].max())) + 2, img_width)
+    y1 = min(int(np.ceil(quad[:, 1].max())) + 2, img_height)
+    if x0 >= x1 or y0 >= y1:
+        return image
+
+    # Same matrix and origin as the full-frame warp: OpenCV computes every destination row from
+    # its absolute coordinates, so cutting rows off the bottom leaves the others unchanged. Moving
+    # the origin (or cutting columns, which changes the vectorised tail) alters the rounding of
+    # the sample positions, so the ROI is only cut out after warping.
+    warped = cv2.warpPerspective(overlay, image_to_overlay, (img_width, y1))[y0:, x0:x1]
+
+    mask = warped.any(axis=-1)
+    np.copyto(image[y0:y1, x0:x1], warped, where=mask[..., None])
+    return image
+
 def create_collage(image1: np.ndarray, image2: np.ndarray, scale: float = 0.6)-> np.ndarray:
     """Creates a side-by-side collage of two images of the same dimensions and scales the final image.
 
@@ -433,6 +633,7 @@ def get_base64_image(file_path: str) -> str:
 
 # Function to add logo at the absolute top of the sidebar
 def add_side_logo() -> None:
+    import streamlit as st  # imported lazily so the image processing helpers stay usable without Streamlit
 
     base64_image = get_base64_image("assets/consistify-logo.png")
 